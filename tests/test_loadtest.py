@@ -0,0 +1,555 @@
+"""
+Offline load test of the registration phases.
+
+Fake versions of the bot, guild, channels and members touched by the progress menus are
+driven by a local event loop, no connection to Discord is made. Run it with pytest from the
+root of the repository, or call `run_inscription`, `run_checkin` and `run_update_roles` to
+get a `LoadReport`.
+"""
+
+import random
+import asyncio
+import itertools
+import statistics
+import tempfile
+import tracemalloc
+
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List
+
+import discord
+
+from tournamentmanager.progress_menu import Inscription, CheckIn, UpdateRoles
+from tournamentmanager.router import PhaseRouter
+from tournamentmanager.roster import RosterStore
+
+
+class FakeHTTP:
+    """
+    Counts the API calls and simulates their latency.
+    """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.calls = 0
+
+    async def call(self):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+
+class FakeBot:
+    def __init__(self, http: FakeHTTP, router: PhaseRouter):
+        self.loop = asyncio.get_event_loop()
+        self.http = http
+        self.router = router
+
+    def dispatch(self, event: str, *args):
+        # only the events that the cog forwards to its router
+        self.loop.create_task(getattr(self.router, f"on_{event}")(*args))
+
+    async def wait_for(self, *args, **kwargs):
+        raise asyncio.TimeoutError
+
+
+class FakeRole:
+    def __init__(self, guild: "FakeGuild", id: int, name: str):
+        self.guild = guild
+        self.id = id
+        self.name = name
+        self.position = 1
+
+    @property
+    def members(self):
+        return [x for x in self.guild.members if self in x.roles]
+
+    def __str__(self):
+        return self.name
+
+
+class FakeMember:
+    def __init__(self, guild: "FakeGuild", id: int):
+        self.guild = guild
+        self.id = id
+        self.roles = []
+        self.bot = False
+
+    def __str__(self):
+        return f"member#{self.id}"
+
+    def _copy(self):
+        before = FakeMember(self.guild, self.id)
+        before.roles = list(self.roles)
+        return before
+
+    async def add_roles(self, *roles, reason: str = None, atomic: bool = True):
+        before = self._copy()
+        for role in roles:
+            # one call per role unless the member is edited at once, like discord.py
+            if atomic:
+                await self.guild.http.call()
+            if role not in self.roles:
+                self.roles.append(role)
+        if not atomic:
+            await self.guild.http.call()
+        self.guild.bot.dispatch("member_update", before, self)
+
+    async def remove_roles(self, *roles, reason: str = None, atomic: bool = True):
+        before = self._copy()
+        for role in roles:
+            if atomic:
+                await self.guild.http.call()
+            if role in self.roles:
+                self.roles.remove(role)
+        if not atomic:
+            await self.guild.http.call()
+        self.guild.bot.dispatch("member_update", before, self)
+
+
+class FakeMessage:
+    def __init__(self, channel: "FakeChannel", id: int, author=None, content: str = ""):
+        self.channel = channel
+        self.guild = channel.guild
+        self.id = id
+        self.author = author
+        self.content = content
+        self.reactions = []
+        self.acked_at: float = None
+
+    async def add_reaction(self, emoji: str):
+        await self.guild.http.call()
+        self.reactions.append(emoji)
+        if emoji == "✅" and self.acked_at is None:
+            self.acked_at = self.guild.bot.loop.time()
+
+    async def remove_reaction(self, emoji: str, user):
+        await self.guild.http.call()
+
+    async def edit(self, **kwargs):
+        await self.guild.http.call()
+
+    async def delete(self):
+        await self.guild.http.call()
+
+
+class FakeChannel:
+    def __init__(self, guild: "FakeGuild", id: int):
+        self.guild = guild
+        self.id = id
+        self.mention = f"<#{id}>"
+        self.sent = []
+
+    async def send(self, content: str = None, **kwargs):
+        await self.guild.http.call()
+        message = FakeMessage(self, self.guild.snowflake(), self.guild.me, content or "")
+        self.sent.append(message)
+        return message
+
+    async def set_permissions(self, *args, **kwargs):
+        await self.guild.http.call()
+
+
+class FakeGuild:
+    def __init__(self, bot: FakeBot, members: int):
+        self.bot = bot
+        self.http = bot.http
+        self.id = 1
+        self._ids = itertools.count(discord.utils.time_snowflake(datetime.utcnow()))
+        self.me = FakeMember(self, self.snowflake())
+        self.members = [FakeMember(self, self.snowflake()) for x in range(members)]
+        self._members = {x.id: x for x in self.members}
+        self.roles = {}
+        self.filesize_limit = 8 * 1024 * 1024
+
+    def snowflake(self) -> int:
+        return next(self._ids)
+
+    def create_role(self, name: str) -> FakeRole:
+        role = FakeRole(self, self.snowflake(), name)
+        self.roles[role.id] = role
+        return role
+
+    def get_member(self, id: int):
+        return self._members.get(id)
+
+    def get_role(self, id: int):
+        return self.roles.get(id)
+
+
+class Typing:
+    async def __aenter__(self):
+        pass
+
+    async def __aexit__(self, *args):
+        pass
+
+
+class FakeContext:
+    def __init__(self, guild: FakeGuild):
+        self.guild = guild
+        self.bot = guild.bot
+        self.channel = FakeChannel(guild, guild.snowflake())
+        self.author = guild.me
+        self.message = FakeMessage(self.channel, guild.snowflake(), self.author)
+        self.clean_prefix = "!"
+
+    async def send(self, content: str = None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+    def typing(self):
+        return Typing()
+
+
+class FakeValue:
+    def __init__(self, config: "FakeConfig", path: tuple):
+        self.config = config
+        self.path = path
+
+    def __getattr__(self, name: str):
+        return FakeValue(self.config, self.path + (name,))
+
+    async def __call__(self):
+        return self.config.values.get(self.path, [])
+
+    async def set(self, value):
+        await self.config.write(self.path, value)
+
+    async def set_raw(self, *keys, value):
+        await self.config.write(self.path + keys, value)
+
+    async def clear_raw(self, *keys):
+        await self.config.write(self.path + keys, None)
+
+
+class FakeConfig:
+    """
+    Stores values in a dict and counts the writes, with an optional storage latency.
+    """
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.values: Dict[tuple, object] = {}
+        self.writes = 0
+        self.write_time = 0.0
+
+    def guild(self, guild: FakeGuild) -> FakeValue:
+        return FakeValue(self, (guild.id,))
+
+    async def write(self, path: tuple, value):
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        self.writes += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.values[path] = value
+        self.write_time += loop.time() - start
+
+
+class LoadReport:
+    def __init__(
+        self,
+        name: str,
+        latencies: List[float],
+        writes: int,
+        write_time: float,
+        http: FakeHTTP,
+        accepted: int,
+        correct: bool,
+        peak_memory: int,
+        duration: float,
+        dropped_acks: int = 0,
+    ):
+        self.name = name
+        # only the confirmations that were sent, the dropped ones are counted apart
+        self.latencies = sorted(latencies)
+        self.dropped_acks = dropped_acks
+        self.writes = writes
+        self.write_time = write_time
+        self.api_calls = http.calls
+        self.accepted = accepted
+        self.correct = correct
+        self.peak_memory = peak_memory
+        self.duration = duration
+
+    def percentile(self, percent: float) -> float:
+        if not self.latencies:
+            return 0.0
+        index = min(len(self.latencies) - 1, round(percent / 100 * (len(self.latencies) - 1)))
+        return self.latencies[index]
+
+    @property
+    def p50(self) -> float:
+        return statistics.median(self.latencies) if self.latencies else 0.0
+
+    @property
+    def p99(self) -> float:
+        return self.percentile(99)
+
+    @property
+    def writes_per_registration(self) -> float:
+        return self.writes / self.accepted if self.accepted else 0.0
+
+    def __str__(self):
+        return (
+            f"{self.name}: {self.accepted} acceptés en {self.duration:.2f}s, "
+            f"latence p50 {self.p50 * 1000:.1f}ms p99 {self.p99 * 1000:.1f}ms "
+            f"({len(self.latencies)} confirmations, {self.dropped_acks} abandonnées), "
+            f"{self.writes} écritures "
+            f"({self.writes_per_registration:.3f} par inscription), "
+            f"{self.api_calls} appels API, roster correct : {self.correct}, "
+            f"pic mémoire {self.peak_memory / 1024:.0f} Kio"
+        )
+
+
+async def _inject(
+    bot: FakeBot,
+    channel: FakeChannel,
+    authors: list,
+    content: str,
+    rate: float,
+    jitter: float = 0,
+):
+    # with a jitter, each event is delivered up to that many seconds late, out of order
+    messages = []
+    sent_at = {}
+    for author in authors:
+        message = FakeMessage(channel, channel.guild.snowflake(), author, content)
+        messages.append(message)
+        sent_at[message.id] = bot.loop.time()
+        if jitter:
+            bot.loop.call_later(random.uniform(0, jitter), bot.dispatch, "message", message)
+        else:
+            bot.dispatch("message", message)
+        await asyncio.sleep(1 / rate)
+    return messages, sent_at
+
+
+def _latencies(messages: list, sent_at: dict) -> List[float]:
+    return [x.acked_at - sent_at[x.id] for x in messages if x.acked_at is not None]
+
+
+async def _drain_acks(n) -> int:
+    # cancel only starts closing the acknowledgers, wait for the last confirmations
+    acks = list(n.acks.values()) if isinstance(n.acks, dict) else [n.acks]
+    for ack in acks:
+        await ack.close()
+    return sum(getattr(x, "dropped", 0) for x in acks)
+
+
+async def _setup(members: int, api_latency: float, config_latency: float):
+    http = FakeHTTP(api_latency)
+    router = PhaseRouter()
+    bot = FakeBot(http, router)
+    guild = FakeGuild(bot, members)
+    return bot, router, guild, FakeConfig(config_latency), FakeContext(guild)
+
+
+async def _inscription(
+    path, members, limit, rate, duplicates, api_latency, config_latency, jitter, ack_interval
+):
+    bot, router, guild, config, ctx = await _setup(members, api_latency, config_latency)
+    rosters = await RosterStore(path).get(guild.id)
+    channel = FakeChannel(guild, guild.snowflake())
+    role = guild.create_role("Tournoi")
+    participant_role = guild.create_role("Participant")
+    blacklist = [x.id for x in guild.members[::50]]
+    n = Inscription(bot, router, rosters, ctx, limit, channel, role, participant_role, blacklist)
+    n.wait_before_start = 0
+    for ack in n.acks.values():
+        ack.interval = ack_interval
+    start = bot.loop.time()
+    await n.run()
+    authors = guild.members + guild.members[:duplicates]
+    messages, sent_at = await _inject(bot, channel, authors, "Je participe", rate, jitter)
+    await n.wait()
+    duration = bot.loop.time() - start
+    dropped = await _drain_acks(n)
+    # first come, first served among the eligible members, in message order
+    expected = []
+    for message in sorted(messages, key=lambda x: x.id):
+        member_id = message.author.id
+        if member_id in blacklist or member_id in expected:
+            continue
+        expected.append(member_id)
+    expected = expected[:limit]
+    # read back from the files
+    stored = list((await RosterStore(path).get(guild.id)).current)
+    correct = list(n.participants) == expected and stored == expected
+    return n, _latencies(messages, sent_at), bot.http, correct, duration, dropped
+
+
+async def _checkin(
+    path, members, rate, api_latency, config_latency, consume_interval, ack_interval
+):
+    bot, router, guild, config, ctx = await _setup(members, api_latency, config_latency)
+    rosters = await RosterStore(path).get(guild.id)
+    channel = FakeChannel(guild, guild.snowflake())
+    checkin_role = guild.create_role("Check")
+    participant_role = guild.create_role("Participant")
+    for member in guild.members:
+        member.roles.append(participant_role)
+    n = CheckIn(bot, router, rosters, ctx, channel, checkin_role, participant_role)
+    n.wait_before_start = 0
+    n.consume_interval = consume_interval
+    n.acks.interval = ack_interval
+    start = bot.loop.time()
+    await n.run()
+    # everyone checks in but the last tenth
+    checking = guild.members[: members - members // 10]
+    messages, sent_at = await _inject(bot, channel, checking, "check", rate)
+    n.schedule_cancel()
+    await n.wait()
+    duration = bot.loop.time() - start
+    dropped = await _drain_acks(n)
+    expected = {x.id for x in guild.members} - {x.id for x in checking}
+    stored = (await RosterStore(path).get(guild.id)).next_to_blacklist
+    correct = set(stored) == expected and all(checkin_role in x.roles for x in checking)
+    return n, _latencies(messages, sent_at), bot.http, correct, duration, dropped
+
+
+async def _update_roles(path, members, api_latency, config_latency, workers):
+    bot, router, guild, config, ctx = await _setup(members, api_latency, config_latency)
+    roles = [guild.create_role("Participant"), guild.create_role("Check")]
+    for member in guild.members[::2]:
+        member.roles.extend(roles)
+    n = UpdateRoles(
+        bot, router, config, ctx, guild.members, roles, "Fin du tournoi", False, workers
+    )
+    start = bot.loop.time()
+    await n.run()
+    await n.wait()
+    duration = bot.loop.time() - start
+    correct = not any(x in y.roles for x in roles for y in guild.members)
+    return n, [], bot.http, correct, duration, 0
+
+
+def _run(name: str, func, *args) -> LoadReport:
+    tracemalloc.start()
+    try:
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            with tempfile.TemporaryDirectory() as path:
+                result = loop.run_until_complete(func(Path(path), *args))
+        finally:
+            # background tasks of the phase, cancelled before the loop goes away
+            pending = asyncio.all_tasks(loop)
+            for task in pending:
+                task.cancel()
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.close()
+            asyncio.set_event_loop(None)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    n, latencies, http, correct, duration, dropped = result
+    return LoadReport(
+        name,
+        latencies,
+        n.stats.writes,
+        n.stats.write_time,
+        http,
+        n.current,
+        correct,
+        peak,
+        duration,
+        dropped,
+    )
+
+
+def run_inscription(
+    members: int = 600,
+    limit: int = 400,
+    rate: float = 300,
+    duplicates: int = 100,
+    api_latency: float = 0.005,
+    config_latency: float = 0.01,
+    jitter: float = 0,
+    ack_interval: float = 0.01,
+) -> LoadReport:
+    """
+    Sends `Je participe` from every member, then again from the first `duplicates` ones,
+    at `rate` messages per second. Events are delivered up to `jitter` seconds late.
+
+    The reactions are paced by `ack_interval` instead of Discord's 250ms, to keep the run
+    short, the confirmations still pending are waited for before the report.
+    """
+    return _run(
+        "Inscription",
+        _inscription,
+        members,
+        limit,
+        rate,
+        duplicates,
+        api_latency,
+        config_latency,
+        jitter,
+        ack_interval,
+    )
+
+
+def run_checkin(
+    members: int = 500,
+    rate: float = 300,
+    api_latency: float = 0.005,
+    config_latency: float = 0.01,
+    consume_interval: float = 0,
+    ack_interval: float = 0.01,
+) -> LoadReport:
+    """
+    Sends `check` from 90% of the participants at `rate` messages per second.
+    """
+    return _run(
+        "CheckIn",
+        _checkin,
+        members,
+        rate,
+        api_latency,
+        config_latency,
+        consume_interval,
+        ack_interval,
+    )
+
+
+def run_update_roles(
+    members: int = 500,
+    api_latency: float = 0.005,
+    config_latency: float = 0.01,
+    workers: int = 5,
+) -> LoadReport:
+    """
+    Removes two roles from all members, half of them already not having the roles.
+    """
+    return _run("UpdateRoles", _update_roles, members, api_latency, config_latency, workers)
+
+
+def test_inscription_burst():
+    report = run_inscription()
+    assert report.correct, report
+    assert report.accepted == 400, report
+    # every accepted message gets a reaction or is named in a summary
+    assert len(report.latencies) + report.dropped_acks == 400, report
+    assert report.writes_per_registration < 0.5, report
+
+
+def test_inscription_late_events():
+    # seats still go to the first messages when their events come out of order
+    report = run_inscription(jitter=0.2)
+    assert report.correct, report
+    assert report.accepted == 400, report
+
+
+def test_checkin_burst():
+    report = run_checkin()
+    assert report.correct, report
+    assert report.accepted == 450, report
+    assert len(report.latencies) + report.dropped_acks == 450, report
+
+
+def test_update_roles():
+    report = run_update_roles()
+    assert report.correct, report
+    # members already without the roles cost nothing, the others one call per role
+    assert report.api_calls < 600, report
@@ -0,0 +1,193 @@
+import discord
+import asyncio
+import heapq
+import logging
+
+from typing import List, Tuple
+
+from redbot.core.bot import Red
+from redbot.core.utils.chat_formatting import pagify
+
+from .ratelimit import RateLimiter
+from .stats import PhaseStats
+
+log = logging.getLogger("red.laggron.tournamentmanager")
+
+
+class Acknowledger:
+    """
+    Confirme aux membres que leur message a été accepté.
+
+    Phases call `ack` from their listener, which never waits on the API. The confirmations
+    are sent by a single task, started with `start` and drained by `close`.
+    """
+
+    def __init__(
+        self,
+        bot: Red,
+        channel: discord.TextChannel,
+        limiter: RateLimiter,
+        stats: PhaseStats,
+        text: str = "Messages acceptés",
+    ):
+        self.bot = bot
+        self.channel = channel
+        self.limiter = limiter
+        self.stats = stats
+        self.text = text
+        self.closing = False
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task = None
+
+    def ack(self, message: discord.Message):
+        raise NotImplementedError
+
+    async def run(self):
+        raise NotImplementedError
+
+    async def post_summary(self, names: List[str]):
+        """
+        Confirms these members with as few messages as possible.
+        """
+        text = f"✅ {self.text} ({len(names)}) : " + ", ".join(names)
+        for page in pagify(text, delims=[", "]):
+            await self.limiter.wait()
+            try:
+                await self.channel.send(page)
+            except discord.errors.HTTPException as e:
+                self.limiter.update(e.response)
+                self.stats.record_api(rate_limited=e.status == 429)
+            else:
+                self.stats.record_api()
+
+    def start(self):
+        self.task = self.bot.loop.create_task(self.run())
+
+    def stop(self):
+        if self.task:
+            self.task.cancel()
+
+    async def close(self):
+        """
+        Sends what is still pending, then ends the task.
+        """
+        if not self.task:
+            return
+        self.closing = True
+        self.wakeup.set()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            log.error("Erreur lors de l'envoi des confirmations", exc_info=e)
+
+
+class ReactionAck(Acknowledger):
+    """
+    Ajoute ✅ aux messages acceptés, un par un.
+
+    Messages wait in a heap and the most recent one is reacted to first, since its author is
+    the most likely to still be looking at the channel. The channel allows about one reaction
+    every 250ms, so when more than `max_pending` messages are waiting, the oldest one leaves
+    the heap instead of delaying every other call on the bucket. Its author is confirmed by
+    a summary message, sent at most every `summary_interval` seconds or once the heap is
+    empty.
+    """
+
+    def __init__(
+        self,
+        *args,
+        interval: float = 0.25,
+        max_pending: int = 100,
+        summary_interval: float = 10,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.interval = interval
+        self.max_pending = max_pending
+        self.summary_interval = summary_interval
+        self.pending: List[Tuple[int, discord.Message]] = []  # newest message first
+        self.overflow: List[str] = []  # confirmed by the next summary
+        self.next_summary: float
+        self.dropped = 0
+
+    def ack(self, message: discord.Message):
+        heapq.heappush(self.pending, (-message.id, message))
+        if len(self.pending) > self.max_pending:
+            oldest = max(self.pending, key=lambda x: x[0])
+            self.pending.remove(oldest)
+            heapq.heapify(self.pending)
+            if not self.overflow:
+                # the members dropped during the next seconds share one summary
+                self.next_summary = asyncio.get_event_loop().time() + self.summary_interval
+            self.overflow.append(str(oldest[1].author))
+            self.dropped += 1
+        self.wakeup.set()
+
+    async def react(self, message: discord.Message):
+        await self.limiter.wait()
+        try:
+            await message.add_reaction("✅")
+        except discord.errors.HTTPException as e:
+            self.limiter.update(e.response)
+            self.stats.record_api(rate_limited=e.status == 429)
+        except Exception:
+            pass
+        else:
+            self.stats.record_api()
+
+    async def run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            if self.overflow and (not self.pending or loop.time() >= self.next_summary):
+                names, self.overflow = self.overflow, []
+                await self.post_summary(names)
+                self.next_summary = loop.time() + self.summary_interval
+            if not self.pending:
+                if self.closing:
+                    break
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            _, message = heapq.heappop(self.pending)
+            await self.react(message)
+            await asyncio.sleep(self.interval)
+        if self.dropped:
+            log.info(
+                f"{self.dropped} réactions remplacées par un résumé dans le channel "
+                f"{self.channel.id}"
+            )
+
+
+class SummaryAck(Acknowledger):
+    """
+    Envoie régulièrement la liste des membres acceptés depuis le dernier envoi.
+
+    One message every `interval` seconds confirms a whole burst, instead of one reaction per
+    message.
+    """
+
+    def __init__(self, *args, interval: float = 10, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.interval = interval
+        self.pending: List[str] = []
+
+    def ack(self, message: discord.Message):
+        self.pending.append(str(message.author))
+
+    async def post(self):
+        names, self.pending = self.pending, []
+        if names:
+            await self.post_summary(names)
+
+    async def run(self):
+        while not self.closing:
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            await self.post()
+
+
+ACK_MODES = {"reaction": ReactionAck, "summary": SummaryAck}
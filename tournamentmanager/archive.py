@@ -0,0 +1,156 @@
+import asyncio
+import sqlite3
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Iterable, List, Tuple
+
+log = logging.getLogger("red.laggron.tournamentmanager")
+
+# status of a member in an archived tournament, the highest one is kept
+REGISTERED = 1  # registered but never got the participant role
+PARTICIPANT = 2  # had the participant role, no check-in recorded
+NO_SHOW = 3  # didn't check in
+CHECKED = 4
+
+STATUS_NAMES = {
+    REGISTERED: "inscrit",
+    PARTICIPANT: "participant",
+    NO_SHOW: "absent",
+    CHECKED: "check",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tournaments (
+    guild_id INTEGER NOT NULL,
+    tournament_id INTEGER NOT NULL,
+    ended_at REAL NOT NULL,
+    registered INTEGER NOT NULL,
+    checked INTEGER NOT NULL,
+    no_shows INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, tournament_id)
+);
+CREATE TABLE IF NOT EXISTS entries (
+    guild_id INTEGER NOT NULL,
+    member_id INTEGER NOT NULL,
+    tournament_id INTEGER NOT NULL,
+    status INTEGER NOT NULL,
+    PRIMARY KEY (guild_id, member_id, tournament_id)
+) WITHOUT ROWID;
+"""
+
+
+class TournamentArchive:
+    """
+    Historique des tournois terminés, dans une base SQLite.
+
+    Entries are keyed by guild, member then tournament, so a member's history is a single
+    index range scan. All queries run on one worker thread, outside of the event loop.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.connection: sqlite3.Connection = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.connection = sqlite3.connect(str(self.path), check_same_thread=False)
+            self.connection.executescript(SCHEMA)
+        return self.connection
+
+    async def _run(self, func, *args):
+        return await asyncio.get_event_loop().run_in_executor(self.executor, func, *args)
+
+    def _record(
+        self,
+        guild_id: int,
+        tournament_id: int,
+        ended_at: float,
+        entries: List[Tuple[int, int]],
+    ):
+        connection = self._connect()
+        statuses = [x for _, x in entries]
+        with connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO tournaments VALUES (?, ?, ?, ?, ?, ?)",
+                (
+                    guild_id,
+                    tournament_id,
+                    ended_at,
+                    len(entries),
+                    statuses.count(CHECKED),
+                    statuses.count(NO_SHOW),
+                ),
+            )
+            connection.executemany(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                ((guild_id, x, tournament_id, y) for x, y in entries),
+            )
+
+    async def record(
+        self,
+        guild_id: int,
+        tournament_id: int,
+        ended_at: float,
+        registered: Iterable[int],
+        participants: Iterable[int],
+        checked: Iterable[int],
+        no_shows: Iterable[int],
+    ):
+        """
+        Archives a finished tournament.
+        """
+        statuses = {}
+        for status, ids in (
+            (REGISTERED, registered),
+            (PARTICIPANT, participants),
+            (NO_SHOW, no_shows),
+            (CHECKED, checked),
+        ):
+            for member_id in ids:
+                statuses[member_id] = max(status, statuses.get(member_id, 0))
+        await self._run(
+            self._record, guild_id, tournament_id, ended_at, list(statuses.items())
+        )
+
+    def _member_summary(self, guild_id: int, member_id: int) -> dict:
+        connection = self._connect()
+        counts = dict(
+            connection.execute(
+                "SELECT status, COUNT(*) FROM entries WHERE guild_id = ? AND member_id = ? "
+                "GROUP BY status",
+                (guild_id, member_id),
+            ).fetchall()
+        )
+        total = connection.execute(
+            "SELECT COUNT(*) FROM tournaments WHERE guild_id = ?", (guild_id,)
+        ).fetchone()[0]
+        return {"counts": counts, "total": total}
+
+    async def member_summary(self, guild_id: int, member_id: int) -> dict:
+        return await self._run(self._member_summary, guild_id, member_id)
+
+    def _member_history(self, guild_id: int, member_id: int, limit: int) -> list:
+        connection = self._connect()
+        return connection.execute(
+            "SELECT e.tournament_id, t.ended_at, e.status FROM entries e "
+            "JOIN tournaments t USING (guild_id, tournament_id) "
+            "WHERE e.guild_id = ? AND e.member_id = ? "
+            "ORDER BY e.tournament_id DESC LIMIT ?",
+            (guild_id, member_id, limit),
+        ).fetchall()
+
+    async def member_history(self, guild_id: int, member_id: int, limit: int = 10) -> list:
+        return await self._run(self._member_history, guild_id, member_id, limit)
+
+    def _close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def close(self):
+        self.executor.submit(self._close)
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,97 @@
+import discord
+import asyncio
+import logging
+
+from collections import deque
+from typing import Callable, Deque, Iterable, Optional, Set, Tuple
+
+from redbot.core.bot import Red
+
+from .ratelimit import RateLimiter
+from .stats import PhaseStats
+
+log = logging.getLogger("red.laggron.tournamentmanager")
+
+
+class DMSender:
+    """
+    Envoie des messages privés à de nombreux membres, un par un.
+
+    `send` only queues the members, a single task sends the messages with a pause between
+    each one and its own rate limiter, since DMs don't count against the guild's buckets.
+    A member whose DMs are closed is skipped for the rest of the phase after the first 403,
+    and a member already waiting in the queue isn't queued twice.
+    """
+
+    def __init__(self, bot: Red, stats: PhaseStats, interval: float = 1):
+        self.bot = bot
+        self.stats = stats
+        self.interval = interval
+        self.limiter = RateLimiter()
+        self.pending: Deque[Tuple[discord.Member, str, Optional[Callable]]] = deque()
+        self.queued: Set[int] = set()  # IDs of the members in pending
+        self.closed: Set[int] = set()  # members who can't receive DMs
+        self.delivered = 0
+        self.failed = 0
+        self.wakeup = asyncio.Event()
+        self.task: asyncio.Task = None
+
+    def send(self, members: Iterable[discord.Member], content: str, check: Callable = None) -> int:
+        """
+        Queues the message for these members. The check, if given, is called with each member
+        right before sending, and the message is skipped if it returns False.
+        """
+        count = 0
+        for member in members:
+            if member.id in self.closed or member.id in self.queued:
+                continue
+            self.pending.append((member, content, check))
+            self.queued.add(member.id)
+            count += 1
+        if count:
+            if self.task is None:
+                self.task = self.bot.loop.create_task(self.run())
+            self.wakeup.set()
+        return count
+
+    async def send_one(self, member: discord.Member, content: str):
+        await self.limiter.wait()
+        start = self.bot.loop.time()
+        try:
+            await member.send(content)
+        except discord.errors.Forbidden:
+            self.stats.record_api()
+            self.closed.add(member.id)
+            self.failed += 1
+        except discord.errors.HTTPException as e:
+            self.limiter.update(e.response)
+            self.stats.record_api(rate_limited=e.status == 429)
+            self.failed += 1
+        else:
+            self.limiter.observe(self.bot.loop.time() - start)
+            self.stats.record_api()
+            self.delivered += 1
+
+    async def run(self):
+        while True:
+            if not self.pending:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            member, content, check = self.pending.popleft()
+            self.queued.discard(member.id)
+            if member.id in self.closed or (check and not check(member)):
+                continue
+            try:
+                await self.send_one(member, content)
+            except Exception as e:
+                log.error(f"Erreur lors de l'envoi d'un message privé à {member.id}", exc_info=e)
+                self.failed += 1
+            await asyncio.sleep(self.interval)
+
+    def stop(self):
+        # what is still queued is dropped, reminders are worthless after the deadline
+        self.pending.clear()
+        self.queued.clear()
+        if self.task:
+            self.task.cancel()
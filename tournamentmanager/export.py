@@ -0,0 +1,110 @@
+import discord
+import io
+import csv
+import gzip
+import json
+
+from typing import List, Optional, Tuple
+
+from redbot.core import commands
+
+FORMATS = ("csv", "json")
+COLUMNS = ("id", "nom", "inscription", "check")
+# room left for the rest of the multipart request
+UPLOAD_MARGIN = 4096
+# Discord accepts up to 10 attachments per message
+FILES_PER_MESSAGE = 10
+
+
+class RosterExport:
+    """
+    Export d'une liste de membres en CSV ou JSON.
+
+    Rows are encoded as they are added, during the phase, so closing only sorts and joins the
+    encoded rows. Files are split to stay under the upload limit of the guild.
+    """
+
+    def __init__(self, name: str, format: str = "csv", compress: bool = False):
+        if format not in FORMATS:
+            raise ValueError(f"Unknown export format {format}")
+        self.name = name
+        self.format = format
+        self.compress = compress
+        self.rows: List[Tuple[int, bytes]] = []  # sort key, encoded row
+        if format == "csv":
+            self.header = self._encode_csv(COLUMNS)
+        else:
+            self.header = b""
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @staticmethod
+    def _encode_csv(row: tuple) -> bytes:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerow(row)
+        return buffer.getvalue().encode()
+
+    def add(
+        self,
+        member_id: int,
+        name: str,
+        message_id: Optional[int] = None,
+        checked: Optional[bool] = None,
+    ):
+        """
+        Adds a member. The registration time is read from the snowflake of its message.
+        """
+        registered_at = None
+        if message_id:
+            registered_at = discord.utils.snowflake_time(message_id).strftime("%Y-%m-%d %H:%M:%S")
+        if self.format == "csv":
+            check = "" if checked is None else ("oui" if checked else "non")
+            row = self._encode_csv((member_id, name, registered_at or "", check))
+        else:
+            values = dict(zip(COLUMNS, (str(member_id), name, registered_at, checked)))
+            row = json.dumps(values, ensure_ascii=False).encode()
+        # members without a message go last, in the order they were added
+        self.rows.append((message_id or (1 << 64) + len(self.rows), row))
+
+    def _pack(self, rows: List[bytes]) -> bytes:
+        if self.format == "csv":
+            data = self.header + b"".join(rows)
+        else:
+            data = b"[\n" + b",\n".join(rows) + b"\n]\n"
+        return gzip.compress(data) if self.compress else data
+
+    def _filename(self, part: int, parts: int) -> str:
+        name = self.name if parts == 1 else f"{self.name}-{part}"
+        return f"{name}.{self.format}" + (".gz" if self.compress else "")
+
+    def files(self, size_limit: int) -> List[discord.File]:
+        """
+        Builds the files, each one under the size limit in bytes.
+        """
+        size_limit -= UPLOAD_MARGIN
+        rows = [x for _, x in sorted(self.rows, key=lambda x: x[0])]
+        parts = []
+        part = []
+        size = len(self.header) + 4
+        for row in rows:
+            # the uncompressed size is an upper bound for a gzipped text file of this size
+            if part and size + len(row) + 2 > size_limit:
+                parts.append(part)
+                part = []
+                size = len(self.header) + 4
+            part.append(row)
+            size += len(row) + 2
+        parts.append(part)
+        return [
+            discord.File(io.BytesIO(self._pack(x)), filename=self._filename(i, len(parts)))
+            for i, x in enumerate(parts, start=1)
+        ]
+
+    async def send(self, ctx: commands.Context, content: str):
+        """
+        Sends the files, on as many messages as needed.
+        """
+        files = self.files(ctx.guild.filesize_limit)
+        for i in range(0, len(files), FILES_PER_MESSAGE):
+            await ctx.send(content if i == 0 else None, files=files[i : i + FILES_PER_MESSAGE])
@@ -1,9 +1,15 @@
 import discord
 import asyncio
 import re
+import math
+import time
+import heapq
+import random
+import hashlib
 import logging
 
 from datetime import datetime, timedelta
+from typing import Iterable, List, Tuple
 
 from redbot.core import commands
 from redbot.core.bot import Red
@@ -12,19 +18,89 @@ from redbot.core.utils.menus import start_adding_reactions
 from redbot.core.utils.predicates import ReactionPredicate
 from redbot.core.utils.chat_formatting import text_to_file, pagify, humanize_list
 
+from .ack import ACK_MODES
+from .dm import DMSender
+from .export import RosterExport
+from .roles import RoleIndex
+from .router import PhaseRouter
+from .roster import GuildRosters
+from .stats import PhaseStats
+
 MESSAGE_CHECK = re.compile(r"^je participe\.?$", flags=re.I)
 CHECKIN_MESSAGE_CHECK = re.compile(r"^!?check\.?$", flags=re.I)
+THROTTLED_INTERVAL_FACTOR = 5
 log = logging.getLogger("red.laggron.tournamentmanager")
 
 
+class EligibilityIndex:
+    """
+    Ensembles d'IDs utilisés pour les vérifications d'admission d'une phase.
+    """
+
+    def __init__(
+        self,
+        participant_role: discord.Role,
+        checkin_role: discord.Role = None,
+        blacklist: Iterable[int] = (),
+    ):
+        self.participant_role_id = participant_role.id if participant_role else None
+        self.checkin_role_id = checkin_role.id if checkin_role else None
+        self.blacklisted = set(blacklist)
+        self.participants = set()  # members with the participant role
+        self.checked = set()  # members with the check-in role
+
+    def build(self, guild: discord.Guild, roles: RoleIndex):
+        # copied from the cog's index when the phase starts, then kept current by update_member
+        role = guild.get_role(self.participant_role_id) if self.participant_role_id else None
+        self.participants = set(roles.members(role)) if role else set()
+        if self.checkin_role_id:
+            role = guild.get_role(self.checkin_role_id)
+            self.checked = set(roles.members(role)) if role else set()
+
+    @staticmethod
+    def _update(ids: set, member_id: int, before: set, after: set, role_id: int):
+        if role_id in after and role_id not in before:
+            ids.add(member_id)
+        elif role_id in before and role_id not in after:
+            ids.discard(member_id)
+
+    def update_member(self, before: discord.Member, after: discord.Member):
+        if before.roles == after.roles:
+            return
+        before_ids = {x.id for x in before.roles}
+        after_ids = {x.id for x in after.roles}
+        if self.participant_role_id:
+            self._update(
+                self.participants, after.id, before_ids, after_ids, self.participant_role_id
+            )
+        if self.checkin_role_id:
+            self._update(self.checked, after.id, before_ids, after_ids, self.checkin_role_id)
+
+
+async def fetch_history_page(bot: Red, channel_id: int, after: int, before: int = None) -> list:
+    """
+    Returns the raw messages following `after`, oldest first.
+    """
+    page = await bot.http.logs_from(channel_id, 100, after=after)
+    if before:
+        page = [x for x in page if int(x["id"]) < before]
+    # messages are returned newest first
+    page.sort(key=lambda x: int(x["id"]))
+    return page
+
+
 class ProgressionMenu:
     """
     Tools for all progress messages.
     """
 
+    # the state is saved in Config and the phase is resumed after a restart
+    persistent = False
+
     def __init__(
         self,
         bot: Red,
+        router: PhaseRouter,
         ctx: commands.Context,
         embed: discord.Embed,
         limit: int,
@@ -32,8 +108,10 @@ class ProgressionMenu:
         interval: float = 1,
         wait_before_start: int = 0,
         time: int = None,
+        state: dict = None,
     ):
         self.bot = bot
+        self.router = router
         self.ctx = ctx
         self.embed = embed
         self.limit = limit
@@ -43,32 +121,45 @@ class ProgressionMenu:
         self.time = time
         self.current = 0
         self.finished = True
+        self.stopped = False
+        self.closed = False  # the saved state is forgotten, it must not be written again
+        self.last_content: dict = None
+        self.stats = PhaseStats(type(self).__name__)
+        # state saved by persistent phases, given back when the phase is resumed after a restart
+        self.resumed = state is not None
+        self.watermark = state["watermark"] if state else 0  # messages before it are handled
+        self.last_seen = self.watermark
         self.message: discord.Message
         self.update_message_task: asyncio.Task
         self.cancel_task: asyncio.Task
-        self.time_task: asyncio.Task
-        self.end_time: datetime
+        self.end_at: float  # timestamp of the deadline, saved in Config
+        if state and "end_at" in state:
+            self.end_at = state["end_at"]
+        self.deadline: float  # same deadline on the loop's monotonic clock
 
     async def edit_message_loop(self):
         while True:
             await self.edit_message()
-            await asyncio.sleep(self.interval)
+            interval = self.interval
+            if self.router.limiter(self.ctx.guild.id).throttled:
+                # leave the rate limit budget to the calls that matter
+                interval *= THROTTLED_INTERVAL_FACTOR
+            start = self.bot.loop.time()
+            await asyncio.sleep(interval)
+            self.stats.record_edit_lag(self.bot.loop.time() - start - interval)
+
+    @staticmethod
+    def format_remaining(seconds: float) -> str:
+        # minute precision until the last minute, so the embed doesn't change every second
+        if seconds > 60:
+            return str(timedelta(minutes=math.ceil(seconds / 60)))
+        return str(timedelta(seconds=max(math.ceil(seconds), 0)))
 
-    async def edit_message(self):
+    def update_embed(self):
         # https://github.com/Cog-Creators/Red-DiscordBot/blob/V3/develop/redbot/cogs/audio/audio.py#L3920
         sections = 40
-        progress = round((self.current / self.limit) * sections)
-        bar = "="
-        seek = ">"
-        empty = " "
-        text = ""
-        for i in range(sections):
-            if i < progress:
-                text += bar
-            elif i == progress:
-                text += seek
-            else:
-                text += empty
+        progress = min(round((self.current / self.limit) * sections), sections)
+        text = ("=" * progress + ">" + " " * sections)[:sections]
         percent = round(self.current / self.limit * 100, 2)
         self.embed.set_field_at(
             0,
@@ -76,21 +167,67 @@ class ProgressionMenu:
             value=f"`[{text}]`\n{self.current}/{self.limit} ({percent}%) {self.text}",
             inline=False,
         )
-        if self.time:
+        if self.time and hasattr(self, "deadline"):
             self.embed.set_field_at(
                 1,
                 name="Temps restant",
-                value=str(self.end_time - datetime.now().replace(microsecond=0)),
+                value=self.format_remaining(self.deadline - self.bot.loop.time()),
                 inline=False,
             )
+
+    async def edit_message(self, force: bool = False):
+        self.update_embed()
+        content = self.embed.to_dict()
+        if force is False and content == self.last_content:
+            return
+        await self.router.wait_for_edit(self.message.channel.id)
+        self.last_content = content
         await self.message.edit(embed=self.embed)
+        self.stats.record_api()
+
+    @property
+    def key(self) -> str:
+        # the command message, kept when the phase is resumed
+        return f"{type(self).__name__}-{self.ctx.message.id}"
+
+    def deadline_info(self) -> dict:
+        """
+        What the cog needs to close the phase if the bot restarts before its deadline.
+        """
+        return {
+            "kind": type(self).__name__,
+            "channel": self.ctx.channel.id,
+            "message": self.ctx.message.id,
+        }
+
+    def state(self) -> dict:
+        """
+        What the cog needs to resume the phase after a restart, for persistent phases.
+        """
+        return {**self.deadline_info(), "limit": self.limit, "watermark": self.watermark}
+
+    async def save_state(self, watermark: int = None):
+        if watermark is not None:
+            self.watermark = watermark
+        if self.closed:
+            return
+        await self.write(self.router.save_state(self.ctx.guild, self.key, self.state()))
 
-    async def check_for_time_loop(self):
+    async def replay(self, channel: discord.TextChannel):
+        """
+        Handles the messages sent after the watermark while the phase wasn't listening.
+        """
+        after = self.watermark
         while True:
-            if self.end_time <= datetime.now():
-                self.cancel_task = self.bot.loop.create_task(self.cancel())
-                return
-            await asyncio.sleep(self.interval)
+            page = await fetch_history_page(self.bot, channel.id, after)
+            self.stats.record_api()
+            if not page:
+                break
+            for data in page:
+                # built like the messages of channel.history
+                message = discord.Message(state=channel._state, channel=channel, data=data)
+                await self.on_message(message)
+            after = int(page[-1]["id"])
 
     async def task(self):
         raise NotImplementedError
@@ -98,6 +235,25 @@ class ProgressionMenu:
     async def before_run(self):
         pass
 
+    async def handle_message(self, message: discord.Message):
+        pass
+
+    async def on_message(self, message: discord.Message):
+        self.last_seen = max(self.last_seen, message.id)
+        self.stats.seen += 1
+        start = self.bot.loop.time()
+        await self.handle_message(message)
+        self.stats.record_handler(self.bot.loop.time() - start)
+
+    async def write(self, coro):
+        # Config write, timed for the stats
+        start = self.bot.loop.time()
+        await coro
+        self.stats.record_write(self.bot.loop.time() - start)
+
+    def on_member_update(self, before: discord.Member, after: discord.Member):
+        pass
+
     async def on_reaction_add(self, reaction: discord.Reaction, user: discord.User):
         if self.finished is True:
             return
@@ -120,25 +276,51 @@ class ProgressionMenu:
         if pred.result is False:
             await message.delete()
             return
-        self.cancel_task = self.bot.loop.create_task(self.cancel())
+        self.schedule_cancel()
 
     async def _cancel(self):
         self.finished = True
-        self.bot.remove_listener(self.on_reaction_add)
+        self.closed = True
+        self.router.remove(self)
+        self.router.last_stats[self.ctx.guild.id] = self.stats
         self.update_message_task.cancel()
         if self.time:
-            self.time_task.cancel()
+            await self.write(self.router.deadlines.forget(self.ctx.guild, self.key))
+        if self.persistent:
+            await self.write(self.router.forget_state(self.ctx.guild, self.key))
         # update one last time for a clean 100%
-        await self.edit_message()
+        await self.edit_message(force=True)
 
     async def cancel(self):
         # overwrite this class and do stuff, but always call self._cancel
         await self._cancel()
 
+    def schedule_cancel(self):
+        if hasattr(self, "cancel_task"):
+            return
+        self.cancel_task = self.bot.loop.create_task(self.cancel())
+        self.cancel_task.add_done_callback(self._cancel_done)
+
+    def _cancel_done(self, task: asyncio.Task):
+        self.stats.end()
+        self.stats.log()
+
+    def stop(self):
+        # the cog is unloaded, stop everything without closing the phase
+        self.finished = True
+        self.stopped = True
+        self.router.remove(self)
+        if hasattr(self, "update_message_task"):
+            self.update_message_task.cancel()
+        if self.time and hasattr(self, "deadline"):
+            # still saved, the cog will close the phase after the restart
+            self.router.deadlines.cancel(self.key)
+
     async def initialize(self):
         self.message = await self.ctx.send(embed=self.embed)
         await self.message.add_reaction("❌")
-        self.bot.add_listener(self.on_reaction_add)
+        self.router.add_message(self.message.id, self)
+        self.router.add_guild(self.ctx.guild.id, self)
         await self.before_run()
 
     async def _run(self):
@@ -146,35 +328,63 @@ class ProgressionMenu:
         await asyncio.sleep(self.wait_before_start)
         self.finished = False
         self.update_message_task = self.bot.loop.create_task(self.edit_message_loop())
-        if self.time:
-            self.end_time = datetime.now().replace(microsecond=0) + timedelta(seconds=self.time)
-            self.time_task = self.bot.loop.create_task(self.check_for_time_loop())
+        if self.time and not self.resumed:
+            await self.arm_deadline()
+
+    async def arm_deadline(self):
+        if not hasattr(self, "end_at"):
+            self.end_at = time.time() + self.time
+        self.deadline = self.bot.loop.time() + self.end_at - time.time()
+        self.router.deadlines.schedule(self.key, self.end_at, self.schedule_cancel)
+        await self.write(
+            self.router.deadlines.save(
+                self.ctx.guild, self.key, self.end_at, **self.deadline_info()
+            )
+        )
 
     async def run(self):
         await self._run()
         await self.task()
+        if self.time and self.resumed:
+            # armed after the replay, a past deadline must not close the phase before
+            await self.arm_deadline()
+
+    async def wait(self):
+        """
+        Waits for the end of the phase, including what is done in cancel.
+        """
+        for task in ("update_message_task", "cancel_task"):
+            if not hasattr(self, task):
+                continue
+            try:
+                await getattr(self, task)
+            except asyncio.CancelledError:
+                pass
 
 
 class UpdateRoles(ProgressionMenu):
     """
     Ajoute des rôles.
+
+    The job is saved in Config with the IDs of the members left to edit, so that it can be
+    resumed after a restart.
     """
 
     def __init__(
         self,
         bot: Red,
+        router: PhaseRouter,
+        data: Config,
         ctx: commands.Context,
         members: list,
         roles: list,
         reason: str,
         add_roles: bool = True,
+        workers: int = 5,
+        job_id: str = None,
     ):
         action = "Ajout" if add_roles else "Retrait"
         embed = discord.Embed(title=f"{action} des rôles")
-        if len(members) < 11:
-            eta = 1
-        else:
-            eta = (len(members) // 10) * 10
         if len(roles) == 1:
             roles_text = roles[0].name
         elif len(roles) == 2:
@@ -186,33 +396,152 @@ class UpdateRoles(ProgressionMenu):
             text = "des rôles " + roles_text
         else:
             text = "du rôle " + roles_text
-        embed.description = (
-            f"{action} {text} à {len(members)} membres...\n" f"Temps estimé : {eta} secondes"
-        )
+        self.description = f"{action} {text} à {len(members)} membres..."
+        embed.description = self.description + "\nTemps estimé : calcul en cours..."
         embed.add_field(name="Progression", value="Démarrage...", inline=False)
-        super().__init__(bot=bot, ctx=ctx, embed=embed, limit=len(members), text="rôles ajoutés")
+        super().__init__(
+            bot=bot,
+            router=router,
+            ctx=ctx,
+            embed=embed,
+            limit=len(members),
+            text="rôles ajoutés",
+        )
+        self.data = data
         self.members = members
         self.roles = roles
         self.reason = reason
         self.add_roles = add_roles
+        self.workers = workers
+        self.job_id = job_id or str(ctx.message.id)
+        self.pending = {x.id for x in members}  # not edited yet, saved by checkpoint_loop
+        self.checkpoint_interval = 5
+        self.checkpoint_task: asyncio.Task
+        self.dirty = False
+        self.limiter = router.limiter(ctx.guild.id)
         self.fails = []
+        self.started_at: float
 
-    async def task(self):
+    def eta(self) -> str:
+        # measured throughput since the start of the job
+        elapsed = self.bot.loop.time() - self.started_at
+        done = self.current + len(self.fails)
+        if not done or elapsed <= 0:
+            return "calcul en cours..."
+        remaining = (self.limit - done) / (done / elapsed)
+        # rounded so that the embed isn't edited for every second of difference
+        return str(timedelta(seconds=math.ceil(remaining / 5) * 5))
+
+    def update_embed(self):
+        super().update_embed()
+        if hasattr(self, "started_at"):
+            self.embed.description = self.description + f"\nTemps estimé : {self.eta()}"
+
+    async def save_job(self):
+        await self.write(
+            self.data.guild(self.ctx.guild).role_jobs.set_raw(
+                self.job_id,
+                value={
+                    "channel": self.ctx.channel.id,
+                    "message": self.ctx.message.id,
+                    "roles": [x.id for x in self.roles],
+                    "add": self.add_roles,
+                    "reason": self.reason,
+                    "pending": list(self.pending),
+                },
+            )
+        )
+
+    async def checkpoint(self):
+        if not self.dirty:
+            return
+        self.dirty = False
+        await self.write(
+            self.data.guild(self.ctx.guild).role_jobs.set_raw(
+                self.job_id, "pending", value=list(self.pending)
+            )
+        )
+
+    async def checkpoint_loop(self):
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            try:
+                await self.checkpoint()
+            except Exception as e:
+                self.dirty = True
+                log.error("Erreur lors de la sauvegarde d'une tâche de rôles", exc_info=e)
+
+    async def update_member(self, member: discord.Member):
+        try:
+            await self._update_member(member)
+        finally:
+            self.pending.discard(member.id)
+            self.dirty = True
+
+    async def _update_member(self, member: discord.Member):
+        # only the roles that still need to be edited, a rerun costs nothing for members done
         if self.add_roles is True:
-            func = lambda x: x.add_roles
+            roles = [x for x in self.roles if x not in member.roles]
+            func = member.add_roles
         else:
-            func = lambda x: x.remove_roles
-        for member in self.members:
+            roles = [x for x in self.roles if x in member.roles]
+            func = member.remove_roles
+        if not roles:
+            self.current += 1
+            self.stats.accepted += 1
+            return
+        for tries in range(5):
+            await self.limiter.wait()
+            start = self.bot.loop.time()
             try:
-                await func(member)(*self.roles, reason=self.reason)
+                # atomic, a member edit would overwrite the roles changed since the cache
+                await func(*roles, reason=self.reason)
             except discord.errors.HTTPException as e:
+                self.limiter.update(e.response)
+                self.stats.record_api(rate_limited=e.status == 429)
+                if e.status == 429 and tries < 4:
+                    continue
                 self.fails.append((member, e))
-            else:
-                self.current += 1
-        self.cancel_task = self.bot.loop.create_task(self.cancel())
+                return
+            self.limiter.observe(self.bot.loop.time() - start)
+            self.stats.record_api()
+            self.current += 1
+            self.stats.accepted += 1
+            return
+
+    async def worker(self, queue: asyncio.Queue):
+        while self.finished is False:
+            try:
+                member = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            self.stats.seen += 1
+            await self.update_member(member)
+
+    async def task(self):
+        queue = asyncio.Queue()
+        for member in self.members:
+            queue.put_nowait(member)
+        await self.save_job()
+        self.checkpoint_task = self.bot.loop.create_task(self.checkpoint_loop())
+        self.started_at = self.bot.loop.time()
+        await asyncio.gather(*[self.worker(queue) for x in range(self.workers)])
+        if self.pending and self.finished is True:
+            # stopped before the end, the job stays saved
+            return
+        self.schedule_cancel()
+
+    def stop(self):
+        super().stop()
+        if hasattr(self, "checkpoint_task"):
+            self.checkpoint_task.cancel()
+            self.bot.loop.create_task(self.checkpoint())
 
     async def cancel(self):
         await self._cancel()
+        if hasattr(self, "checkpoint_task"):
+            self.checkpoint_task.cancel()
+        await self.write(self.data.guild(self.ctx.guild).role_jobs.clear_raw(self.job_id))
         file = None
         if self.fails:
             text = ""
@@ -230,99 +559,454 @@ class UpdateRoles(ProgressionMenu):
         )
 
 
+class HistoryScan(ProgressionMenu):
+    """
+    Lecture de l'historique d'un channel d'inscription.
+
+    Pages of raw messages are requested directly between two snowflakes, no Message object
+    is built for messages that don't match.
+    """
+
+    def __init__(
+        self,
+        bot: Red,
+        router: PhaseRouter,
+        ctx: commands.Context,
+        limit: int,
+        channel: discord.TextChannel,
+        participant_role: discord.Role,
+        blacklist: list,
+        after: int = 0,
+        before: int = None,
+        export: RosterExport = None,
+    ):
+        embed = discord.Embed(title="Enregistrement manuel")
+        embed.description = f"Lecture de l'historique du channel {channel.mention}..."
+        embed.add_field(name="Progression", value="Démarrage...", inline=False)
+        embed.set_footer(text="Cliquez sur ❌ pour annuler la recherche.")
+        super().__init__(bot, router, ctx, embed, limit, text="membres trouvés")
+        self.channel = channel
+        self.index = EligibilityIndex(participant_role, blacklist=blacklist)
+        self.participants = {}  # member ID -> registration message ID
+        self.scanned = 0
+        self.after = after
+        self.before = before or discord.utils.time_snowflake(datetime.utcnow())
+        self.export = export or RosterExport("participants")
+
+    def update_embed(self):
+        super().update_embed()
+        self.embed.description = (
+            f"Lecture de l'historique du channel {self.channel.mention}...\n"
+            f"{self.scanned} messages lus."
+        )
+
+    async def fetch_page(self, after: int) -> list:
+        page = await fetch_history_page(self.bot, self.channel.id, after, self.before)
+        self.stats.record_api()
+        return page
+
+    def admit(self, data: dict):
+        if data["author"].get("bot"):
+            return
+        if not MESSAGE_CHECK.match(data["content"]):
+            return
+        member_id = int(data["author"]["id"])
+        if member_id in self.index.blacklisted:
+            return
+        if member_id in self.index.participants:
+            return
+        if member_id in self.participants:
+            return
+        self.participants[member_id] = int(data["id"])
+        author = data["author"]
+        self.export.add(
+            member_id, f"{author['username']}#{author['discriminator']}", int(data["id"])
+        )
+        self.current += 1
+        self.stats.accepted += 1
+
+    async def task(self):
+        after = self.after
+        while self.finished is False and self.current < self.limit:
+            page = await self.fetch_page(after)
+            if not page:
+                break
+            for data in page:
+                self.scanned += 1
+                self.stats.seen += 1
+                self.admit(data)
+                if self.current >= self.limit:
+                    break
+            after = int(page[-1]["id"])
+        self.schedule_cancel()
+
+    async def before_run(self):
+        self.index.build(self.ctx.guild, self.router.roles)
+
+
 class Inscription(ProgressionMenu):
     """
     Inscriptions du vendredi et samedi après-midi.
     """
 
+    persistent = True
+
     def __init__(
         self,
         bot: Red,
-        data: Config,
+        router: PhaseRouter,
+        rosters: GuildRosters,
         ctx: commands.Context,
         limit: int,
         channel: discord.TextChannel,
         role: discord.Role,
         participant_role: discord.Role,
         blacklist: list,
+        export: RosterExport = None,
+        ack: str = "reaction",
+        state: dict = None,
+        shards: List[discord.TextChannel] = (),
     ):
         embed = discord.Embed(title="Inscription au tournoi")
-        embed.description = f"L'inscription est en cours dans le channel {channel.mention}"
+        if shards:
+            mentions = humanize_list([x.mention for x in (channel, *shards)])
+            embed.description = f"L'inscription est en cours dans les channels {mentions}"
+        else:
+            embed.description = f"L'inscription est en cours dans le channel {channel.mention}"
         embed.add_field(name="Progression", value="Démarrage dans 10 secondes...", inline=True)
         embed.set_footer(text="Cliquez sur ❌ pour annuler l'inscription.")
         embed.colour = 0x00FF33
-        super().__init__(bot, ctx, embed, limit, text="membres inscrits", wait_before_start=10)
-        self.data = data
+        super().__init__(
+            bot,
+            router,
+            ctx,
+            embed,
+            limit,
+            text="membres inscrits",
+            wait_before_start=0 if state else 10,
+            state=state,
+        )
+        self.rosters = rosters
         self.channel = channel
+        # every channel feeds the same ledger, the snowflakes give a global order
+        self.channels = [channel, *shards]
         self.role = role
         self.participant_role = participant_role
-        self.blacklist = blacklist
+        self.index = EligibilityIndex(participant_role, blacklist=blacklist)
+        # source of truth during the phase, ordered member ID -> registration message ID
+        # accepted IDs are appended to the current roster, written by flush_loop and on cancel
+        self.participants = {}
+        if state:
+            # the message IDs are lost, only the order remains
+            self.participants = dict.fromkeys(rosters.current)
+            self.current = len(self.participants)
+        self.export = export or RosterExport("participants")
+        # one per channel, the reaction rate limit is per channel
+        self.acks = {
+            x.id: ACK_MODES[ack](
+                bot, x, router.limiter(ctx.guild.id), self.stats, text="Inscriptions enregistrées"
+            )
+            for x in self.channels
+        }
+        # candidates wait here for a short time, then are admitted in snowflake order by
+        # ingest_loop, so the seats go to the first messages even if their events come late
+        self.pending: List[Tuple[int, float, discord.Message]] = []
+        self.pending_event = asyncio.Event()
+        self.reorder_window = 0.5
+        self.ingest_task: asyncio.Task
+        self.flush_interval = 5
+        self.flush_task: asyncio.Task
 
-    async def on_message(self, message: discord.Message):
+    async def flush(self):
+        # everything up to this message is in the roster once it is written
+        if self.pending:
+            watermark = self.pending[0][0] - 1
+        else:
+            watermark = self.last_seen
+        if self.rosters.current.dirty:
+            await self.write(self.rosters.current.flush())
+        if watermark != self.watermark:
+            await self.save_state(watermark)
+
+    def state(self) -> dict:
+        return {
+            **super().state(),
+            "phase_channel": self.channel.id,
+            "shards": [x.id for x in self.channels[1:]],
+            "role": self.role.id,
+            "participant_role": self.participant_role.id,
+        }
+
+    async def flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                log.error("Erreur lors de l'enregistrement des participants", exc_info=e)
+
+    async def handle_message(self, message: discord.Message):
         if self.finished is True:
             return
-        if message.channel.id != self.channel.id:
-            return
         if not MESSAGE_CHECK.match(message.content):
             return
         member = message.author
-        if member.id in self.blacklist:
+        if member.id in self.index.blacklisted:
             return
-        if self.participant_role in member.roles:
+        if member.id in self.index.participants:
             return
-        async with self.data.guild(self.ctx.guild).current() as participants:
-            if member.id in participants:
-                return
-            participants.append(member.id)
+        if member.id in self.participants:
+            return
+        heapq.heappush(self.pending, (message.id, self.bot.loop.time(), message))
+        self.pending_event.set()
+
+    def admit(self, message: discord.Message):
+        member = message.author
+        if self.current >= self.limit or member.id in self.participants:
+            return
+        self.participants[member.id] = message.id
+        self.rosters.current.add(member.id)
+        self.export.add(member.id, str(member), message.id)
         self.current += 1
+        self.stats.accepted += 1
         if self.current >= self.limit:
             self.finished = True
-            if not hasattr(self, "cancel_task"):
-                self.cancel_task = self.bot.loop.create_task(self.cancel())
-        try:
-            await message.add_reaction("✅")
-        except Exception:
-            pass
+            self.schedule_cancel()
+        self.acks[message.channel.id].ack(message)
+
+    def admit_pending(self):
+        while self.pending:
+            self.admit(heapq.heappop(self.pending)[2])
+
+    async def ingest_loop(self):
+        while True:
+            if not self.pending:
+                self.pending_event.clear()
+                await self.pending_event.wait()
+                continue
+            _, received_at, message = self.pending[0]
+            delay = received_at + self.reorder_window - self.bot.loop.time()
+            if delay > 0:
+                # an older message may still come, or take the top of the heap meanwhile
+                await asyncio.sleep(delay)
+                continue
+            heapq.heappop(self.pending)
+            self.admit(message)
+
+    def on_member_update(self, before: discord.Member, after: discord.Member):
+        self.index.update_member(before, after)
+
+    def stop(self):
+        super().stop()
+        for acks in self.acks.values():
+            acks.stop()
+        if hasattr(self, "ingest_task"):
+            self.ingest_task.cancel()
+        if hasattr(self, "flush_task"):
+            self.flush_task.cancel()
+            self.bot.loop.create_task(self.flush())
 
     async def task(self):
-        self.bot.add_listener(self.on_message)
-        await self.channel.set_permissions(
-            self.role, send_messages=True, read_messages=True, reason="Ouverture des inscriptions"
-        )
+        self.flush_task = self.bot.loop.create_task(self.flush_loop())
+        self.ingest_task = self.bot.loop.create_task(self.ingest_loop())
+        for acks in self.acks.values():
+            acks.start()
+        # routed first, the channels may still be open after a crash and the messages sent
+        # during the replay would be lost, the ledger drops the ones seen twice
+        for channel in self.channels:
+            self.router.add_channel(channel.id, self)
+        if self.resumed:
+            for channel in self.channels:
+                await self.replay(channel)
+            # the history is already in order
+            self.admit_pending()
+            if self.finished:
+                # the limit was reached while the bot was offline
+                return
+        for channel in self.channels:
+            await channel.set_permissions(
+                self.role,
+                send_messages=True,
+                read_messages=True,
+                reason="Ouverture des inscriptions",
+            )
 
     async def before_run(self):
-        await self.channel.send(
+        self.index.build(self.ctx.guild, self.router.roles)
+        if self.resumed:
+            for member_id in self.participants:
+                self.export.add(member_id, str(self.ctx.guild.get_member(member_id)))
+            return
+        text = (
             "__Inscription pour le prochain tournoi__\n\n"
             "- Envoyez `Je participe` dans ce channel pour s'inscrire\n"
             "- Éditer le message ne marche pas\n"
             "- Si vous pensez qu'il y a eu un problème, contactez un PK Thunder\n\n"
-            "Ouverture dans 10 secondes."
         )
+        if len(self.channels) > 1:
+            mentions = humanize_list([x.mention for x in self.channels])
+            text += (
+                f"Les inscriptions sont réparties entre {mentions}, inscrivez-vous dans un "
+                "seul de ces channels, le premier message compte.\n\n"
+            )
+        messages = [await x.send(text + "Ouverture dans 10 secondes.") for x in self.channels]
+        await self.save_state(messages[0].id)
 
     async def cancel(self):
         await self._cancel()
-        self.bot.remove_listener(self.on_message)
-        await self.channel.set_permissions(
-            self.role, send_messages=False, read_messages=True, reason="Fermeture des inscriptions"
-        )
-        await self.channel.send("Fin des inscriptions.")
-        participants = await self.data.guild(self.ctx.guild).current()
-        next_to_blacklist = await self.data.guild(self.ctx.guild).next_to_blacklist()
-        await self.data.guild(self.ctx.guild).next_to_blacklist.set(
-            [x for x in next_to_blacklist if x not in participants]
-        )
+        # messages sent before the end are still admitted, within the limit
+        self.ingest_task.cancel()
+        self.admit_pending()
+        self.flush_task.cancel()
+        await self.flush()
+        await self.close_channels()
+        await self.send_results()
+
+    async def close_channels(self):
+        for channel in self.channels:
+            await channel.set_permissions(
+                self.role,
+                send_messages=False,
+                read_messages=True,
+                reason="Fermeture des inscriptions",
+            )
+        # the last confirmations are sent in the background
+        for acks in self.acks.values():
+            self.bot.loop.create_task(acks.close())
+        for channel in self.channels:
+            await channel.send("Fin des inscriptions.")
+
+    async def send_results(self, text: str = None):
+        text = text or f"Inscription terminée, {self.current} membres enregistrés."
+        participants = list(self.participants)
+        next_to_blacklist = self.rosters.next_to_blacklist
+        for member_id in participants:
+            next_to_blacklist.discard(member_id)
+        if next_to_blacklist.dirty:
+            await self.write(next_to_blacklist.flush())
         try:
             async with self.ctx.typing():
-                content = "\n".join((str(self.ctx.guild.get_member(x)) for x in participants))
-                file = text_to_file(content, "participants.txt")
-                await self.ctx.send(
-                    f"Inscription terminée, {self.current} membres enregistrés.", file=file,
-                )
+                await self.export.send(self.ctx, text)
         except Exception as e:
             log.error("Erreur dans l'envoi d'un fichier après inscription", exc_info=e)
+            await self.ctx.send(text + "\nIl y a eu une erreur lors de l'envoi du fichier.")
+
+
+class Lottery(Inscription):
+    """
+    Inscriptions par tirage au sort.
+
+    Every eligible message sent during the window is an entry, kept in a dict with no write
+    and no limit, so the first seconds don't decide anything. At the end, the entries are
+    shuffled with a generator seeded by a hash of their message IDs, only known once the
+    window is closed: the first `limit` get a seat, the others form the ranked waitlist, and
+    the same entries always give the same draw.
+    """
+
+    def __init__(self, *args, time: int = 600, state: dict = None, **kwargs):
+        super().__init__(*args, state=state, **kwargs)
+        self.time = time
+        self.embed.title = "Tirage au sort du tournoi"
+        self.embed.add_field(name="Temps restant", value=str(timedelta(seconds=time)))
+        self.text = "membres inscrits au tirage"
+        # member ID -> entry message ID, the draw is only written at the end
+        self.entries = {}
+        self.participants = {}
+        self.current = 0
+        self.seed: int
+        self.waitlist: List[int] = []
+        # messages sent after the end of the window, read by a replay, are not entries
+        self.last_snowflake: int = None
+        if state and "end_at" in state:
+            self.set_last_snowflake()
+
+    def set_last_snowflake(self):
+        end = datetime.utcfromtimestamp(self.end_at)
+        self.last_snowflake = discord.utils.time_snowflake(end, high=True)
+
+    def deadline_info(self) -> dict:
+        info = super().deadline_info()
+        info.update(
+            phase_channel=self.channel.id,
+            role=self.role.id,
+            shards=[x.id for x in self.channels[1:]],
+        )
+        return info
+
+    def state(self) -> dict:
+        state = super().state()
+        if hasattr(self, "end_at"):
+            state["end_at"] = self.end_at
+        return state
+
+    async def arm_deadline(self):
+        await super().arm_deadline()
+        self.set_last_snowflake()
+        if not self.resumed:
+            # the window keeps its end after a restart
+            await self.save_state()
+
+    async def flush(self):
+        # nothing is written during the window, a resumed phase replays the whole channel
+        pass
+
+    async def handle_message(self, message: discord.Message):
+        if self.finished is True:
+            return
+        if not MESSAGE_CHECK.match(message.content):
+            return
+        if self.last_snowflake and message.id > self.last_snowflake:
+            return
+        member = message.author
+        if member.id in self.index.blacklisted:
+            return
+        if member.id in self.index.participants:
+            return
+        if member.id in self.entries:
+            return
+        self.entries[member.id] = message.id
+        self.current += 1
+        self.stats.accepted += 1
+        self.acks[message.channel.id].ack(message)
+
+    def draw(self) -> Tuple[List[int], List[int]]:
+        """
+        Returns the members with a seat and the waitlist, in order.
+        """
+        # sorted first, the order of the events must not change the result
+        entries = sorted(self.entries, key=self.entries.get)
+        digest = hashlib.sha256(b"".join(self.entries[x].to_bytes(8, "big") for x in entries))
+        self.seed = int.from_bytes(digest.digest()[:8], "big")
+        random.Random(self.seed).shuffle(entries)
+        return entries[: self.limit], entries[self.limit :]
+
+    async def cancel(self):
+        await self._cancel()
+        self.ingest_task.cancel()
+        self.flush_task.cancel()
+        await self.close_channels()
+        seats, self.waitlist = self.draw()
+        self.participants = {x: self.entries[x] for x in seats}
+        self.current = len(seats)
+        self.rosters.current.replace(seats)
+        self.rosters.waitlist.replace(self.waitlist)
+        for roster in (self.rosters.current, self.rosters.waitlist):
+            await self.write(roster.flush())
+        guild = self.ctx.guild
+        for member_id in seats:
+            self.export.add(member_id, str(guild.get_member(member_id)), self.entries[member_id])
+        text = (
+            f"Tirage terminé (graine {self.seed}) : {len(self.entries)} membres inscrits, "
+            f"{len(seats)} places attribuées, {len(self.waitlist)} en liste d'attente."
+        )
+        await self.send_results(text)
+        if self.waitlist:
+            ranking = "\n".join(
+                f"{i}. {guild.get_member(x) or x} ({x})"
+                for i, x in enumerate(self.waitlist, start=1)
+            )
             await self.ctx.send(
-                f"Inscription terminée, {self.current} membres enregistrés.\n"
-                "Il y a eu une erreur lors de l'envoi du fichier."
+                "Liste d'attente :", file=text_to_file(ranking, filename="attente.txt")
             )
 
 
@@ -331,67 +1015,225 @@ class CheckIn(ProgressionMenu):
     Phase de check-in
     """
 
+    persistent = True
+
     def __init__(
         self,
         bot: Red,
-        data: Config,
+        router: PhaseRouter,
+        rosters: GuildRosters,
         ctx: commands.Context,
         channel: discord.TextChannel,
         checkin_role: discord.Role,
         participant_role: discord.Role,
+        export: RosterExport = None,
+        ack: str = "reaction",
+        time: int = 1800,
+        state: dict = None,
+        reminders: Iterable[int] = (),
     ):
         embed = discord.Embed(title="Check-in")
         embed.description = f"Le check-in est en cours dans le channel {channel.mention}"
         embed.add_field(name="Progression", value="Démarrage dans 10 secondes.", inline=False)
-        embed.add_field(name="Temps restant", value="0:30:00", inline=False)
+        embed.add_field(name="Temps restant", value=str(timedelta(seconds=time)), inline=False)
+        if reminders:
+            embed.add_field(name="Rappels", value="Aucun rappel envoyé", inline=False)
         embed.set_footer(text="Cliquez sur ❌ pour annuler l'inscription.")
         embed.colour = 0x0033FF
         super().__init__(
             bot,
+            router,
             ctx,
             embed,
-            len(participant_role.members),
+            router.roles.count(participant_role),
             "joueurs check",
-            wait_before_start=10,
-            time=1800,
+            wait_before_start=0 if state else 10,
+            time=time,
+            state=state,
         )
-        self.data = data
+        self.rosters = rosters
         self.channel = channel
         self.checkin_role = checkin_role
         self.participant_role = participant_role
+        self.index = EligibilityIndex(participant_role, checkin_role)
+        self.limiter = router.limiter(ctx.guild.id)
+        self.acks = ACK_MODES[ack](
+            bot, channel, self.limiter, self.stats, text="Check-ins enregistrés"
+        )
+        # the listener only validates, roles and reactions are applied by consume_loop
+        self.queue = asyncio.Queue()
+        self.queued = {}  # member ID -> message ID
+        self.consume_interval = 0.5
+        self.consume_task: asyncio.Task
+        self.checkpoint_interval = 5
+        self.checkpoint_task: asyncio.Task
         self.checked = []
+        self.export = export or RosterExport("participants")
         self.failed = []
         self.to_blacklist: list
+        # seconds before the deadline, the members who didn't check yet get a DM
+        self.reminders = sorted(set(reminders), reverse=True)
+        self.dms = DMSender(bot, self.stats)
 
-    async def on_message(self, message: discord.Message):
+    async def handle_message(self, message: discord.Message):
         if self.finished is True:
             return
-        if message.channel.id != self.channel.id:
-            return
         if not CHECKIN_MESSAGE_CHECK.match(message.content):
             return
         member = message.author
-        if self.participant_role not in member.roles:
+        if member.id not in self.index.participants:
             return
-        if member in self.checked:
+        if member.id in self.index.checked or member.id in self.queued:
             return
+        self.queued[member.id] = message.id
+        self.queue.put_nowait((member, message))
+        self.stats.accepted += 1
+
+    async def check_member(self, member: discord.Member, message: discord.Message):
+        await self.limiter.wait()
+        start = self.bot.loop.time()
         try:
             await member.add_roles(self.checkin_role, reason="Check-in tournoi")
         except discord.errors.HTTPException as e:
+            self.limiter.update(e.response)
+            self.stats.record_api(rate_limited=e.status == 429)
             self.failed.append((member, e))
             return
+        finally:
+            self.queued.pop(member.id, None)
+        self.limiter.observe(self.bot.loop.time() - start)
+        self.stats.record_api()
+        self.index.checked.add(member.id)
         self.checked.append(member)
-        self.current = len(self.checked)
+        self.export.add(member.id, str(member), message.id, checked=True)
+        # members with the check-in role who aren't participants, like the staff, don't count
+        self.current = len(self.index.checked & self.index.participants)
         if self.current >= self.limit:
             self.finished = True
-            self.cancel_task = self.bot.loop.create_task(self.cancel())
-        try:
-            await message.add_reaction("✅")
-        except Exception:
-            pass
+            self.schedule_cancel()
+        self.acks.ack(message)
+
+    async def consume_loop(self):
+        while True:
+            member, message = await self.queue.get()
+            try:
+                await self.check_member(member, message)
+            except Exception as e:
+                log.error("Erreur lors du check-in d'un membre", exc_info=e)
+            finally:
+                self.queue.task_done()
+            await asyncio.sleep(self.consume_interval)
+
+    async def checkpoint(self):
+        # queued messages are lost on a restart, they must be replayed
+        if self.queued:
+            watermark = min(self.queued.values()) - 1
+        else:
+            watermark = self.last_seen
+        if watermark != self.watermark:
+            await self.save_state(watermark)
+
+    async def checkpoint_loop(self):
+        while True:
+            await asyncio.sleep(self.checkpoint_interval)
+            try:
+                await self.checkpoint()
+            except Exception as e:
+                log.error("Erreur lors de l'enregistrement du check-in", exc_info=e)
+
+    def state(self) -> dict:
+        state = {**super().state(), "checkin_role": self.checkin_role.id}
+        if hasattr(self, "end_at"):
+            state["end_at"] = self.end_at
+        return state
+
+    def update_embed(self):
+        pending = len(self.queued)
+        self.text = f"joueurs check ({pending} en attente)" if pending else "joueurs check"
+        super().update_embed()
+        self.update_reminders_field()
+
+    def update_reminders_field(self):
+        if not self.reminders:
+            return
+        dms = self.dms
+        if dms.delivered or dms.failed:
+            value = f"{dms.delivered} messages privés envoyés, {dms.failed} échecs"
+        else:
+            value = "Aucun rappel envoyé"
+        self.embed.set_field_at(2, name="Rappels", value=value, inline=False)
+
+    def is_pending(self, member: discord.Member) -> bool:
+        return member.id not in self.index.checked and member.id not in self.queued
+
+    def reminder_text(self) -> str:
+        remaining = self.format_remaining(self.end_at - time.time())
+        return (
+            f"Rappel : le check-in du tournoi sur **{self.ctx.guild.name}** se termine dans "
+            f"{remaining}. Envoyez `check` dans {self.channel.mention} pour confirmer votre "
+            "participation."
+        )
+
+    def remind(self):
+        # called by the scheduler, the DMs are only queued
+        if self.finished:
+            return
+        pending = self.index.participants - self.index.checked
+        members = self.router.roles.resolve(self.ctx.guild, pending)
+        members = [x for x in members if not x.bot and self.is_pending(x)]
+        count = self.dms.send(members, self.reminder_text(), check=self.is_pending)
+        log.info(f"Rappel de check-in pour {count} membres dans le serveur {self.ctx.guild.id}")
+
+    def reminder_keys(self) -> List[str]:
+        return [f"{self.key}-reminder-{x}" for x in self.reminders]
+
+    async def arm_deadline(self):
+        await super().arm_deadline()
+        # not saved, armed again with the deadline when the phase is resumed
+        for key, offset in zip(self.reminder_keys(), self.reminders):
+            if self.end_at - offset > time.time():
+                self.router.deadlines.schedule(key, self.end_at - offset, self.remind)
+
+    def cancel_reminders(self):
+        for key in self.reminder_keys():
+            self.router.deadlines.cancel(key)
+        self.dms.stop()
+
+    async def _cancel(self):
+        self.cancel_reminders()
+        # the state is forgotten by _cancel, the loop must not save it again
+        if hasattr(self, "checkpoint_task"):
+            self.checkpoint_task.cancel()
+        await super()._cancel()
+
+    def stop(self):
+        super().stop()
+        self.cancel_reminders()
+        self.acks.stop()
+        if hasattr(self, "consume_task"):
+            self.consume_task.cancel()
+        if hasattr(self, "checkpoint_task"):
+            self.checkpoint_task.cancel()
+            self.bot.loop.create_task(self.checkpoint())
+
+    def on_member_update(self, before: discord.Member, after: discord.Member):
+        self.index.update_member(before, after)
+
+    def deadline_info(self) -> dict:
+        info = super().deadline_info()
+        info.update(phase_channel=self.channel.id, role=self.participant_role.id)
+        return info
 
     async def task(self):
-        self.bot.add_listener(self.on_message)
+        self.consume_task = self.bot.loop.create_task(self.consume_loop())
+        self.checkpoint_task = self.bot.loop.create_task(self.checkpoint_loop())
+        self.acks.start()
+        # routed before the replay, like the inscription
+        self.router.add_channel(self.channel.id, self)
+        if self.resumed:
+            await self.replay(self.channel)
+            if self.finished:
+                return
         await self.channel.set_permissions(
             self.participant_role,
             send_messages=True,
@@ -400,17 +1242,24 @@ class CheckIn(ProgressionMenu):
         )
 
     async def before_run(self):
-        await self.channel.send(
+        self.index.build(self.ctx.guild, self.router.roles)
+        self.current = len(self.index.checked & self.index.participants)
+        if self.resumed:
+            # the role is the record of the members who checked before the restart
+            for member_id in self.index.checked & self.index.participants:
+                self.export.add(member_id, str(self.ctx.guild.get_member(member_id)), checked=True)
+            return
+        message = await self.channel.send(
             "__Check pour le prochain tournoi__\n\n"
             "- Envoyez `check` dans ce channel pour confirmer l'inscription\n"
             "- Éditer le message ne marche pas\n"
             "- Si vous pensez qu'il y a eu un problème, contactez un PK Thunder\n\n"
             "Ouverture dans 10 secondes."
         )
+        await self.save_state(message.id)
 
     async def cancel(self):
         await self._cancel()
-        self.bot.remove_listener(self.on_message)
         await self.channel.set_permissions(
             self.participant_role,
             read_messages=True,
@@ -418,30 +1267,179 @@ class CheckIn(ProgressionMenu):
             reason="Fermeture du check-in",
         )
         await self.channel.send("Fin du check-in.")
+        # members who checked before the end still get their role
+        await self.queue.join()
+        self.consume_task.cancel()
+        self.bot.loop.create_task(self.acks.close())
+        to_blacklist = self.index.participants - self.index.checked
+        self.to_blacklist = list(filter(None, map(self.ctx.guild.get_member, to_blacklist)))
+        for member in self.to_blacklist:
+            self.export.add(member.id, str(member), checked=False)
         try:
             async with self.ctx.typing():
-                content = "\n".join((str(x) for x in self.checked))
-                files = [text_to_file(content, "participants.txt")]
+                await self.export.send(
+                    self.ctx,
+                    f"Check-in terminé, {self.current}/{len(self.index.participants)} "
+                    f"membres enregistrés.\nN'oubliez pas de taper `{self.ctx.clean_prefix}"
+                    "endtournament` à la fin du tournoi pour tout compléter.",
+                )
                 if self.failed:
                     content = "\n".join(
                         f"{str(x)}: {type(e)}: {e.args[0]}" for x, e in self.failed
                     )
-                    files.append(text_to_file(content, "fails.txt"))
-                await self.ctx.send(
-                    f"Check-in terminé, {len(self.checked)}/{len(self.participant_role.members)} "
-                    f"membres enregistrés.\nN'oubliez pas de taper `{self.ctx.clean_prefix}"
-                    "endtournament` à la fin du tournoi pour tout compléter.",
-                    files=files,
-                )
+                    await self.ctx.send(file=text_to_file(content, "fails.txt"))
         except Exception as e:
             log.error("Erreur dans l'envoi d'un fichier après check-in", exc_info=e)
             await self.ctx.send(
-                f"Check-in terminé, {len(self.checked)}/{len(self.participant_role.members)} "
+                f"Check-in terminé, {self.current}/{len(self.index.participants)} "
                 "membres enregistrés. Il y a eu une erreur lors de l'envoi du fichier.\nN'oubliez "
                 f"pas de taper `{self.ctx.clean_prefix}endtournament` à la "
                 "fin du tournoi pour tout compléter."
             )
-        self.to_blacklist = [x for x in self.participant_role.members if x not in self.checked]
-        await self.data.guild(self.ctx.guild).next_to_blacklist.set(
-            [x.id for x in self.to_blacklist]
+        self.rosters.next_to_blacklist.replace(to_blacklist)
+        await self.write(self.rosters.next_to_blacklist.flush())
+
+
+class ReactionCheckIn(CheckIn):
+    """
+    Phase de check-in par réaction sur un message épinglé.
+
+    Reaction events only move the progress bar, without any API call. At the end, the users of
+    the reaction are read in pages of 100 and the roles are given by the cog in one role job.
+    """
+
+    def __init__(self, *args, state: dict = None, **kwargs):
+        super().__init__(*args, state=state, **kwargs)
+        self.check_message_id: int = state.get("check_message") if state else None
+        self.reacted = set()  # participants who reacted, without the check-in role yet
+        self.to_check: list
+
+    def state(self) -> dict:
+        return {**super().state(), "check_message": self.check_message_id}
+
+    async def checkpoint(self):
+        # the reactions stay on Discord, there is nothing to replay
+        pass
+
+    def update_embed(self):
+        ProgressionMenu.update_embed(self)
+        self.update_reminders_field()
+
+    def is_pending(self, member: discord.Member) -> bool:
+        return super().is_pending(member) and member.id not in self.reacted
+
+    def reminder_text(self) -> str:
+        remaining = self.format_remaining(self.end_at - time.time())
+        return (
+            f"Rappel : le check-in du tournoi sur **{self.ctx.guild.name}** se termine dans "
+            f"{remaining}. Réagissez avec ✅ au message épinglé dans {self.channel.mention} "
+            "pour confirmer votre participation."
         )
+
+    async def on_reaction_add(self, reaction: discord.Reaction, user: discord.User):
+        if reaction.message.id != self.check_message_id:
+            await super().on_reaction_add(reaction, user)
+            return
+        if self.finished is True or str(reaction.emoji) != "✅":
+            return
+        self.stats.seen += 1
+        if user.id not in self.index.participants or user.id in self.index.checked:
+            return
+        if user.id in self.reacted:
+            return
+        self.reacted.add(user.id)
+        self.stats.accepted += 1
+        self.current += 1
+        if self.current >= self.limit:
+            self.finished = True
+            self.schedule_cancel()
+
+    async def fetch_reactions(self) -> set:
+        ids = set()
+        after = None
+        while True:
+            await self.limiter.wait()
+            page = await self.bot.http.get_reaction_users(
+                self.channel.id, self.check_message_id, "✅", 100, after=after
+            )
+            self.stats.record_api()
+            ids.update(int(x["id"]) for x in page)
+            if len(page) < 100:
+                return ids
+            after = int(page[-1]["id"])
+
+    async def task(self):
+        self.router.add_message(self.check_message_id, self)
+        await self.channel.set_permissions(
+            self.participant_role,
+            read_messages=True,
+            send_messages=False,
+            add_reactions=True,
+            reason="Ouverture du check-in",
+        )
+
+    async def before_run(self):
+        self.index.build(self.ctx.guild, self.router.roles)
+        self.current = len(self.index.checked & self.index.participants)
+        if self.resumed:
+            # reactions added while the bot was offline
+            reacted = await self.fetch_reactions() & self.index.participants
+            self.reacted = reacted - self.index.checked
+            self.current += len(self.reacted)
+            return
+        message = await self.channel.send(
+            "__Check pour le prochain tournoi__\n\n"
+            "- Réagissez avec ✅ sur ce message pour confirmer l'inscription\n"
+            "- Si vous pensez qu'il y a eu un problème, contactez un PK Thunder\n\n"
+            "Ouverture dans 10 secondes."
+        )
+        self.check_message_id = message.id
+        await message.add_reaction("✅")
+        try:
+            await message.pin()
+        except discord.errors.HTTPException:
+            pass
+        await self.save_state(message.id)
+
+    async def cancel(self):
+        await self._cancel()
+        await self.channel.set_permissions(
+            self.participant_role,
+            read_messages=True,
+            send_messages=False,
+            add_reactions=False,
+            reason="Fermeture du check-in",
+        )
+        await self.channel.send("Fin du check-in.")
+        try:
+            await self.bot.http.unpin_message(self.channel.id, self.check_message_id)
+        except discord.errors.HTTPException:
+            pass
+        # the reactions are the source of truth, events may have been missed
+        reacted = (await self.fetch_reactions() & self.index.participants) - self.index.checked
+        checked = self.index.checked | reacted
+        self.current = len(checked & self.index.participants)
+        guild = self.ctx.guild
+        self.to_check = list(filter(None, map(guild.get_member, reacted)))
+        to_blacklist = self.index.participants - checked
+        self.to_blacklist = list(filter(None, map(guild.get_member, to_blacklist)))
+        for member_id in checked & self.index.participants:
+            self.export.add(member_id, str(guild.get_member(member_id)), checked=True)
+        for member in self.to_blacklist:
+            self.export.add(member.id, str(member), checked=False)
+        try:
+            async with self.ctx.typing():
+                await self.export.send(
+                    self.ctx,
+                    f"Check-in terminé, {self.current}/{len(self.index.participants)} "
+                    f"membres enregistrés.\nN'oubliez pas de taper `{self.ctx.clean_prefix}"
+                    "endtournament` à la fin du tournoi pour tout compléter.",
+                )
+        except Exception as e:
+            log.error("Erreur dans l'envoi d'un fichier après check-in", exc_info=e)
+            await self.ctx.send(
+                f"Check-in terminé, {self.current}/{len(self.index.participants)} "
+                "membres enregistrés. Il y a eu une erreur lors de l'envoi du fichier."
+            )
+        self.rosters.next_to_blacklist.replace(to_blacklist)
+        await self.write(self.rosters.next_to_blacklist.flush())
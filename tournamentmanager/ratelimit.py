@@ -0,0 +1,72 @@
+import asyncio
+import logging
+
+log = logging.getLogger("red.laggron.tournamentmanager")
+
+# a call taking longer than this was most likely held back by discord.py's own rate limiting
+SLOW_CALL = 1.5
+# how long a guild is considered throttled after a slow call or a 429
+THROTTLE_MEMORY = 5
+
+
+class RateLimiter:
+    """
+    Suivi des limites de l'API Discord pour un serveur.
+
+    Shared by all phases of a guild: role workers pause on it after a 429 or an exhausted
+    bucket, and the progress menus read `throttled` to slow down their own edits.
+    """
+
+    def __init__(self):
+        self.loop = asyncio.get_event_loop()
+        self.resume_at = 0.0  # loop time before which no call should be started
+        self.throttled_until = 0.0
+        self.calls = 0
+        self.hits = 0  # 429 received
+
+    @property
+    def throttled(self) -> bool:
+        return self.loop.time() < max(self.resume_at, self.throttled_until)
+
+    def backoff(self, delay: float):
+        now = self.loop.time()
+        self.resume_at = max(self.resume_at, now + delay)
+        self.throttled_until = max(self.throttled_until, now + delay + THROTTLE_MEMORY)
+
+    async def wait(self):
+        delay = self.resume_at - self.loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def observe(self, duration: float):
+        """
+        Records a successful call and how long it took.
+        """
+        self.calls += 1
+        if duration > SLOW_CALL:
+            self.throttled_until = max(
+                self.throttled_until, self.loop.time() + THROTTLE_MEMORY
+            )
+
+    def update(self, response):
+        """
+        Reads the rate limit headers of a failed call's response.
+        """
+        self.calls += 1
+        if response is None:
+            return
+        headers = response.headers
+        if response.status == 429:
+            self.hits += 1
+            delay = headers.get("Retry-After") or headers.get("X-RateLimit-Reset-After")
+            try:
+                delay = float(delay)
+            except (TypeError, ValueError):
+                delay = 1
+            log.warning("429 reçu, pause de %s secondes.", delay)
+            self.backoff(delay)
+        elif headers.get("X-RateLimit-Remaining") == "0":
+            try:
+                self.backoff(float(headers.get("X-RateLimit-Reset-After")))
+            except (TypeError, ValueError):
+                pass
@@ -0,0 +1,73 @@
+import discord
+
+from typing import Dict, Iterable, List, Set
+
+
+class RoleIndex:
+    """
+    IDs des membres de chaque rôle suivi, par serveur.
+
+    A role is indexed with one scan of the guild members the first time it is asked for, then
+    kept current by the member update, join and leave events, so counts and set operations
+    no longer depend on the size of the guild.
+    """
+
+    def __init__(self):
+        self.guilds: Dict[int, Dict[int, Set[int]]] = {}  # guild ID -> role ID -> member IDs
+
+    def members(self, role: discord.Role) -> Set[int]:
+        """
+        Returns the IDs of the members with this role. The set must not be modified.
+        """
+        roles = self.guilds.setdefault(role.guild.id, {})
+        try:
+            return roles[role.id]
+        except KeyError:
+            pass
+        ids = roles[role.id] = {x.id for x in role.guild.members if role in x.roles}
+        return ids
+
+    def count(self, role: discord.Role) -> int:
+        return len(self.members(role))
+
+    def union(self, *roles: discord.Role) -> Set[int]:
+        ids = set()
+        for role in roles:
+            ids |= self.members(role)
+        return ids
+
+    def resolve(self, guild: discord.Guild, ids: Iterable[int]) -> List[discord.Member]:
+        return list(filter(None, map(guild.get_member, ids)))
+
+    def on_member_update(self, before: discord.Member, after: discord.Member):
+        roles = self.guilds.get(after.guild.id)
+        if not roles or before.roles == after.roles:
+            return
+        role_ids = {x.id for x in after.roles}
+        for role_id, ids in roles.items():
+            if role_id in role_ids:
+                ids.add(after.id)
+            else:
+                ids.discard(after.id)
+
+    def on_member_join(self, member: discord.Member):
+        roles = self.guilds.get(member.guild.id)
+        if not roles:
+            return
+        for role in member.roles:
+            if role.id in roles:
+                roles[role.id].add(member.id)
+
+    def on_member_remove(self, member: discord.Member):
+        roles = self.guilds.get(member.guild.id)
+        if not roles:
+            return
+        for ids in roles.values():
+            ids.discard(member.id)
+
+    def forget_role(self, role: discord.Role):
+        self.guilds.get(role.guild.id, {}).pop(role.id, None)
+
+    def clear(self):
+        # events may have been missed, roles are scanned again when needed
+        self.guilds.clear()
@@ -0,0 +1,276 @@
+import asyncio
+import os
+import heapq
+import struct
+import logging
+
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+log = logging.getLogger("red.laggron.tournamentmanager")
+
+# one record per operation: the operation and a member ID
+RECORD = struct.Struct("<BQ")
+# same for bans, followed by the expiry: tournament count and timestamp, 0 for none
+BAN_RECORD = struct.Struct("<BQId")
+ADD = 1
+REMOVE = 2
+CLEAR = 3
+
+# the file is rewritten when it holds this many times more records than IDs
+COMPACT_RATIO = 2
+COMPACT_MIN_RECORDS = 1024
+
+
+class Roster:
+    """
+    Ensemble ordonné d'IDs de membres, enregistré dans un fichier en ajout seul.
+
+    Changes are applied in memory at once and buffered as fixed-size records, then appended
+    to the file by `flush`. Loading replays the whole file in one read.
+    """
+
+    record = RECORD
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.ids: Dict[int, None] = {}  # dict used as an ordered set
+        self.buffer = bytearray()
+        self.records = 0  # records in the file
+        self.new = True  # the file didn't exist when loaded
+        self.lock = asyncio.Lock()
+
+    def __contains__(self, member_id: int) -> bool:
+        return member_id in self.ids
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self.ids)
+
+    @property
+    def dirty(self) -> bool:
+        return bool(self.buffer)
+
+    def load(self):
+        try:
+            with open(self.path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return
+        self.new = False
+        # an interrupted write may leave a partial record at the end
+        data = data[: len(data) - len(data) % self.record.size]
+        self._replay(self.record.iter_unpack(data))
+        self.records = len(data) // self.record.size
+
+    def _replay(self, records: Iterator[tuple]):
+        ids = self.ids
+        for op, member_id in records:
+            if op == ADD:
+                ids[member_id] = None
+            elif op == REMOVE:
+                ids.pop(member_id, None)
+            elif op == CLEAR:
+                ids.clear()
+
+    def _pack(self, op: int, member_id: int) -> bytes:
+        return RECORD.pack(op, member_id)
+
+    def add(self, member_id: int) -> bool:
+        if member_id in self.ids:
+            return False
+        self.ids[member_id] = None
+        self.buffer += self._pack(ADD, member_id)
+        return True
+
+    def extend(self, ids: Iterable[int]):
+        for member_id in ids:
+            self.add(member_id)
+
+    def discard(self, member_id: int) -> bool:
+        if member_id not in self.ids:
+            return False
+        del self.ids[member_id]
+        self.buffer += self._pack(REMOVE, member_id)
+        return True
+
+    def clear(self):
+        self.ids.clear()
+        # previous records are meaningless now
+        self.buffer = bytearray(self._pack(CLEAR, 0))
+
+    def replace(self, ids: Iterable[int]):
+        self.clear()
+        self.extend(ids)
+
+    def _append(self, data: bytes):
+        with open(self.path, "ab") as file:
+            file.write(data)
+
+    def _rewrite(self, data: bytes):
+        temp = self.path.with_suffix(".tmp")
+        with open(temp, "wb") as file:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp, self.path)
+
+    async def flush(self):
+        if not self.buffer:
+            return
+        loop = asyncio.get_event_loop()
+        async with self.lock:
+            pending, self.buffer = bytes(self.buffer), bytearray()
+            records = self.records + len(pending) // self.record.size
+            try:
+                if records >= COMPACT_MIN_RECORDS and records > COMPACT_RATIO * len(self.ids):
+                    # the IDs already include the buffered changes
+                    data = b"".join(self._pack(ADD, x) for x in self.ids)
+                    await loop.run_in_executor(None, self._rewrite, data)
+                    self.records = len(self.ids)
+                else:
+                    await loop.run_in_executor(None, self._append, pending)
+                    self.records = records
+            except Exception:
+                # kept for the next flush
+                self.buffer[0:0] = pending
+                raise
+        self.new = False
+
+
+class BanRoster(Roster):
+    """
+    Membres bannis des tournois, avec la fin de chaque ban.
+
+    A ban ends once the guild has ended `until_tournament` tournaments, at the `until`
+    timestamp, or never when both are 0. Two heaps ordered by expiry let `expire` pop the
+    ended bans without scanning them all. Entries of bans removed or changed since are
+    skipped when they reach the top.
+    """
+
+    record = BAN_RECORD
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+        self.ids: Dict[int, Tuple[int, float]] = {}  # member ID -> tournament count, timestamp
+        self.by_tournament: List[Tuple[int, int]] = []
+        self.by_date: List[Tuple[float, int]] = []
+
+    def _replay(self, records: Iterator[tuple]):
+        ids = self.ids
+        for op, member_id, until_tournament, until in records:
+            if op == ADD:
+                ids[member_id] = (until_tournament, until)
+            elif op == REMOVE:
+                ids.pop(member_id, None)
+            elif op == CLEAR:
+                ids.clear()
+        self.by_tournament = [(x[0], y) for y, x in ids.items() if x[0]]
+        self.by_date = [(x[1], y) for y, x in ids.items() if x[1]]
+        heapq.heapify(self.by_tournament)
+        heapq.heapify(self.by_date)
+
+    def _pack(self, op: int, member_id: int) -> bytes:
+        return BAN_RECORD.pack(op, member_id, *self.ids.get(member_id, (0, 0)))
+
+    def add(self, member_id: int, until_tournament: int = 0, until: float = 0) -> bool:
+        """
+        Bans the member, or changes the end of its ban.
+        """
+        expiry = (until_tournament, until)
+        if self.ids.get(member_id) == expiry:
+            return False
+        # packed first, an invalid expiry must not leave a ban that is never written
+        record = BAN_RECORD.pack(ADD, member_id, *expiry)
+        self.ids[member_id] = expiry
+        self.buffer += record
+        if until_tournament:
+            heapq.heappush(self.by_tournament, (until_tournament, member_id))
+        if until:
+            heapq.heappush(self.by_date, (until, member_id))
+        return True
+
+    def clear(self):
+        super().clear()
+        self.by_tournament.clear()
+        self.by_date.clear()
+
+    def expire(self, tournament_count: int, now: float) -> List[int]:
+        """
+        Removes the bans ended at this tournament count and time, returns their member IDs.
+        """
+        ended = []
+        heaps = ((0, self.by_tournament, tournament_count), (1, self.by_date, now))
+        for i, heap, current in heaps:
+            while heap and heap[0][0] <= current:
+                value, member_id = heapq.heappop(heap)
+                expiry = self.ids.get(member_id)
+                if expiry is None or expiry[i] != value:
+                    continue
+                self.discard(member_id)
+                ended.append(member_id)
+        return ended
+
+
+class GuildRosters:
+    """
+    Les listes d'IDs d'un serveur.
+    """
+
+    # the lists that used to be stored in Config
+    NAMES = ("current", "blacklisted", "next_to_blacklist")
+
+    def __init__(self, path: Path, guild_id: int):
+        self.current = Roster(path / f"{guild_id}-current.bin")
+        self.blacklisted = BanRoster(path / f"{guild_id}-bans.bin")
+        # bans without expiry, kept until the cog imports them
+        self.legacy_blacklisted = Roster(path / f"{guild_id}-blacklisted.bin")
+        self.next_to_blacklist = Roster(path / f"{guild_id}-next_to_blacklist.bin")
+        self.waitlist = Roster(path / f"{guild_id}-waitlist.bin")  # ranked, from the lottery
+
+    def __iter__(self) -> Iterator[Roster]:
+        return iter((self.current, self.blacklisted, self.next_to_blacklist, self.waitlist))
+
+    def load(self):
+        for roster in self:
+            roster.load()
+        if self.blacklisted.new:
+            self.legacy_blacklisted.load()
+
+    async def flush(self):
+        for roster in self:
+            await roster.flush()
+
+
+class RosterStore:
+    """
+    Charge et garde en cache les listes de chaque serveur.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.guilds: Dict[int, GuildRosters] = {}
+        self.lock = asyncio.Lock()
+
+    async def get(self, guild_id: int) -> GuildRosters:
+        try:
+            return self.guilds[guild_id]
+        except KeyError:
+            pass
+        async with self.lock:
+            if guild_id in self.guilds:
+                return self.guilds[guild_id]
+            self.path.mkdir(parents=True, exist_ok=True)
+            rosters = GuildRosters(self.path, guild_id)
+            await asyncio.get_event_loop().run_in_executor(None, rosters.load)
+            self.guilds[guild_id] = rosters
+            return rosters
+
+    async def flush(self):
+        for rosters in self.guilds.values():
+            try:
+                await rosters.flush()
+            except Exception as e:
+                log.error("Erreur lors de l'enregistrement des listes", exc_info=e)
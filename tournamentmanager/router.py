@@ -0,0 +1,119 @@
+import discord
+import asyncio
+import logging
+
+from typing import Dict, List, TYPE_CHECKING
+
+from redbot.core import Config
+
+from .ratelimit import RateLimiter
+from .roles import RoleIndex
+from .scheduler import DeadlineScheduler
+from .stats import PhaseStats
+
+if TYPE_CHECKING:
+    from .progress_menu import ProgressionMenu
+
+# Discord allows 5 message edits per 5 seconds in a channel
+EDIT_RATE = 1
+log = logging.getLogger("red.laggron.tournamentmanager")
+
+
+class PhaseRouter:
+    """
+    Distribue les événements Discord aux phases actives.
+
+    The cog owns one router and forwards its listeners here, so an event that doesn't concern
+    any phase is dropped after a single dict lookup.
+    """
+
+    def __init__(self, data: Config = None):
+        self.data = data
+        self.channels: Dict[int, "ProgressionMenu"] = {}  # channel ID -> phase
+        self.messages: Dict[int, "ProgressionMenu"] = {}  # message ID -> phase
+        self.guilds: Dict[int, List["ProgressionMenu"]] = {}  # guild ID -> phases
+        self.limiters: Dict[int, RateLimiter] = {}  # guild ID -> rate limits
+        self.next_edit: Dict[int, float] = {}  # channel ID -> loop time of the next free slot
+        self.last_stats: Dict[int, PhaseStats] = {}  # guild ID -> stats of the last phase
+        self.roles = RoleIndex()
+        self.deadlines = DeadlineScheduler(data)
+
+    def add_channel(self, channel_id: int, phase: "ProgressionMenu"):
+        self.channels[channel_id] = phase
+
+    def add_message(self, message_id: int, phase: "ProgressionMenu"):
+        self.messages[message_id] = phase
+
+    def add_guild(self, guild_id: int, phase: "ProgressionMenu"):
+        phases = self.guilds.setdefault(guild_id, [])
+        if phase not in phases:
+            phases.append(phase)
+
+    def remove(self, phase: "ProgressionMenu"):
+        for mapping in (self.channels, self.messages):
+            for key in [x for x, y in mapping.items() if y is phase]:
+                del mapping[key]
+        for guild_id, phases in list(self.guilds.items()):
+            if phase in phases:
+                phases.remove(phase)
+            if not phases:
+                del self.guilds[guild_id]
+
+    async def save_state(self, guild: discord.Guild, key: str, state: dict):
+        # state of the running phases, resumed by the cog on load
+        if self.data is None:
+            return
+        await self.data.guild(guild).running.set_raw(key, value=state)
+
+    async def forget_state(self, guild: discord.Guild, key: str):
+        if self.data is None:
+            return
+        await self.data.guild(guild).running.clear_raw(key)
+
+    def limiter(self, guild_id: int) -> RateLimiter:
+        try:
+            return self.limiters[guild_id]
+        except KeyError:
+            limiter = self.limiters[guild_id] = RateLimiter()
+            return limiter
+
+    async def wait_for_edit(self, channel_id: int):
+        """
+        Waits for a free slot to edit a message, shared by all menus of the channel.
+        """
+        now = asyncio.get_event_loop().time()
+        slot = max(now, self.next_edit.get(channel_id, 0))
+        self.next_edit[channel_id] = slot + EDIT_RATE
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def active(self, guild: discord.Guild = None) -> List["ProgressionMenu"]:
+        if guild:
+            return list(self.guilds.get(guild.id, []))
+        return [x for y in self.guilds.values() for x in y]
+
+    async def on_message(self, message: discord.Message):
+        phase = self.channels.get(message.channel.id)
+        if phase is None:
+            return
+        await phase.on_message(message)
+
+    async def on_reaction_add(self, reaction: discord.Reaction, user: discord.User):
+        phase = self.messages.get(reaction.message.id)
+        if phase is None:
+            return
+        await phase.on_reaction_add(reaction, user)
+
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        self.roles.on_member_update(before, after)
+        phases = self.guilds.get(after.guild.id)
+        if not phases:
+            return
+        for phase in phases:
+            phase.on_member_update(before, after)
+
+    async def on_member_join(self, member: discord.Member):
+        self.roles.on_member_join(member)
+
+    async def on_member_remove(self, member: discord.Member):
+        self.roles.on_member_remove(member)
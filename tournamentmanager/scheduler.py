@@ -0,0 +1,74 @@
+import discord
+import asyncio
+import time
+import logging
+
+from typing import Callable, Dict, Optional
+
+from redbot.core import Config
+
+log = logging.getLogger("red.laggron.tournamentmanager")
+
+
+class DeadlineScheduler:
+    """
+    Échéances des phases, déclenchées une seule fois.
+
+    Deadlines are given as wall clock timestamps, so they can be saved, and armed once with
+    `loop.call_at` on the monotonic clock: a change of the system time doesn't move them and
+    no task has to poll. When a Config is given, `save` and `forget` keep them in the
+    `deadlines` group of the guild so the cog can arm them again after a restart.
+    """
+
+    def __init__(self, data: Optional[Config] = None):
+        self.data = data
+        self.handles: Dict[str, asyncio.TimerHandle] = {}
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.handles
+
+    @staticmethod
+    def to_loop_time(timestamp: float) -> float:
+        loop = asyncio.get_event_loop()
+        return loop.time() + timestamp - time.time()
+
+    def schedule(self, key: str, timestamp: float, callback: Callable, *args):
+        """
+        Calls the callback at the given timestamp, or at once if it is already past. A callback
+        returning a coroutine gets its own task.
+        """
+        self.cancel(key)
+        loop = asyncio.get_event_loop()
+        self.handles[key] = loop.call_at(
+            self.to_loop_time(timestamp), self._fire, key, callback, args
+        )
+
+    def _fire(self, key: str, callback: Callable, args: tuple):
+        del self.handles[key]
+        try:
+            result = callback(*args)
+            if asyncio.iscoroutine(result):
+                asyncio.get_event_loop().create_task(result)
+        except Exception as e:
+            log.error(f"Erreur lors de l'échéance {key}", exc_info=e)
+
+    def cancel(self, key: str):
+        handle = self.handles.pop(key, None)
+        if handle:
+            handle.cancel()
+
+    def cancel_all(self):
+        for handle in self.handles.values():
+            handle.cancel()
+        self.handles.clear()
+
+    async def save(self, guild: discord.Guild, key: str, timestamp: float, **info):
+        if self.data is None:
+            return
+        await self.data.guild(guild).deadlines.set_raw(key, value={"at": timestamp, **info})
+
+    async def forget(self, guild: discord.Guild, key: str):
+        self.cancel(key)
+        if self.data is None:
+            return
+        await self.data.guild(guild).deadlines.clear_raw(key)
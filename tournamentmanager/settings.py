@@ -0,0 +1,89 @@
+import discord
+import asyncio
+
+from typing import Dict, List, Optional
+
+from redbot.core import Config
+
+
+class GuildSettings:
+    """
+    Réglages d'un serveur, gardés en mémoire.
+
+    Loaded once from Config, then updated by the `tournamentset` commands and the
+    role/channel delete events, so reading a setting never waits on Config.
+    """
+
+    GROUPS = ("roles", "channels", "export", "phases", "shards")
+
+    def __init__(self, data: dict, defaults: dict):
+        # Config only merges the first level of defaults, a group written one key at a time
+        # misses the others
+        data = {x: {**defaults[x], **data.get(x, {})} for x in self.GROUPS}
+        self.roles: Dict[str, Optional[int]] = data["roles"]
+        self.channels: Dict[str, Optional[int]] = data["channels"]
+        self.export: dict = data["export"]
+        self.phases: dict = data["phases"]
+        self.shards: Dict[str, List[int]] = {x: list(y) for x, y in data["shards"].items()}
+
+    def find(self, object_id: int) -> list:
+        """
+        Returns the (group, key) of the settings pointing to this ID.
+        """
+        return [
+            (group, key)
+            for group in ("roles", "channels")
+            for key, value in getattr(self, group).items()
+            if value == object_id
+        ]
+
+
+class SettingsStore:
+    """
+    Charge et garde en cache les réglages de chaque serveur.
+    """
+
+    def __init__(self, data: Config, defaults: dict):
+        self.data = data
+        self.defaults = defaults  # registered defaults of the guild
+        self.guilds: Dict[int, GuildSettings] = {}
+        self.lock = asyncio.Lock()
+
+    def load_all(self, all_guilds: dict):
+        """
+        Fills the cache with the result of `Config.all_guilds`.
+        """
+        for guild_id, data in all_guilds.items():
+            self.guilds.setdefault(guild_id, GuildSettings(data, self.defaults))
+
+    async def get(self, guild: discord.Guild) -> GuildSettings:
+        try:
+            return self.guilds[guild.id]
+        except KeyError:
+            pass
+        async with self.lock:
+            if guild.id not in self.guilds:
+                data = await self.data.guild(guild).all()
+                self.guilds[guild.id] = GuildSettings(data, self.defaults)
+            return self.guilds[guild.id]
+
+    async def set(self, guild: discord.Guild, group: str, key: str, value: Optional[int]):
+        settings = await self.get(guild)
+        await self.data.guild(guild).get_attr(group).set_raw(key, value=value)
+        getattr(settings, group)[key] = value
+
+    async def forget(self, guild: discord.Guild, object_id: int) -> list:
+        """
+        Unsets the settings pointing to a deleted role or channel.
+        """
+        settings = self.guilds.get(guild.id)
+        if settings is None:
+            return []
+        found = settings.find(object_id)
+        for group, key in found:
+            await self.set(guild, group, key, None)
+        for key, ids in settings.shards.items():
+            if object_id in ids:
+                await self.set(guild, "shards", key, [x for x in ids if x != object_id])
+                found.append(("shards", key))
+        return found
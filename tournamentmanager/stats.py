@@ -0,0 +1,117 @@
+import time
+import json
+import logging
+
+from bisect import bisect_left
+from datetime import timedelta
+
+log = logging.getLogger("red.laggron.tournamentmanager")
+
+# upper bounds of the handler latency histogram, in seconds
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5)
+
+
+def _format_bucket(seconds: float) -> str:
+    if seconds < 1:
+        return f"{seconds * 1000:g}ms"
+    return f"{seconds:g}s"
+
+
+class PhaseStats:
+    """
+    Métriques d'une phase, affichées par `tstats`.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.started_at = time.time()
+        self.ended_at: float = None
+        self.seen = 0  # messages received by the listener
+        self.accepted = 0  # messages or members processed successfully
+        self.latencies = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.handled = 0
+        self.max_latency = 0.0
+        self.writes = 0
+        self.write_time = 0.0
+        self.api_calls = 0
+        self.rate_limited = 0  # 429 received
+        self.edit_lag = 0.0  # total delay of the edit loop compared to its interval
+        self.max_edit_lag = 0.0
+        self.edits = 0
+
+    @property
+    def duration(self) -> float:
+        return (self.ended_at or time.time()) - self.started_at
+
+    @property
+    def throughput(self) -> float:
+        duration = self.duration
+        return self.accepted / duration if duration > 0 else 0.0
+
+    def record_handler(self, duration: float):
+        self.handled += 1
+        self.latencies[bisect_left(LATENCY_BUCKETS, duration)] += 1
+        self.max_latency = max(self.max_latency, duration)
+
+    def record_write(self, duration: float):
+        self.writes += 1
+        self.write_time += duration
+
+    def record_api(self, rate_limited: bool = False):
+        self.api_calls += 1
+        if rate_limited:
+            self.rate_limited += 1
+
+    def record_edit_lag(self, lag: float):
+        self.edits += 1
+        lag = max(lag, 0)
+        self.edit_lag += lag
+        self.max_edit_lag = max(self.max_edit_lag, lag)
+
+    def end(self):
+        if self.ended_at is None:
+            self.ended_at = time.time()
+
+    def to_dict(self) -> dict:
+        return {
+            "phase": self.name,
+            "started_at": self.started_at,
+            "duration": round(self.duration, 3),
+            "seen": self.seen,
+            "accepted": self.accepted,
+            "latency_histogram": dict(
+                zip([_format_bucket(x) for x in LATENCY_BUCKETS] + ["+"], self.latencies)
+            ),
+            "max_latency": round(self.max_latency, 4),
+            "writes": self.writes,
+            "write_time": round(self.write_time, 4),
+            "api_calls": self.api_calls,
+            "rate_limited": self.rate_limited,
+            "avg_edit_lag": round(self.edit_lag / self.edits, 4) if self.edits else 0,
+            "max_edit_lag": round(self.max_edit_lag, 4),
+            "throughput": round(self.throughput, 3),
+        }
+
+    def log(self):
+        log.info("Fin de phase %s: %s", self.name, json.dumps(self.to_dict()))
+
+    def format(self) -> str:
+        histogram = ", ".join(
+            f"≤{_format_bucket(x)}: {y}" for x, y in zip(LATENCY_BUCKETS, self.latencies) if y
+        )
+        if self.latencies[-1]:
+            histogram += f", >{_format_bucket(LATENCY_BUCKETS[-1])}: {self.latencies[-1]}"
+        avg_write = self.write_time / self.writes * 1000 if self.writes else 0
+        avg_lag = self.edit_lag / self.edits * 1000 if self.edits else 0
+        status = "terminée" if self.ended_at else "en cours"
+        return (
+            f"__{self.name}__ ({status}, {timedelta(seconds=round(self.duration))})\n"
+            f"- Messages vus / acceptés : **{self.seen}** / **{self.accepted}**\n"
+            f"- Latence des handlers : {histogram or 'aucune donnée'} "
+            f"(max {self.max_latency * 1000:.1f}ms)\n"
+            f"- Écritures de données : **{self.writes}** ({avg_write:.1f}ms en moyenne)\n"
+            f"- Appels API : **{self.api_calls}** dont **{self.rate_limited}** 429\n"
+            f"- Retard de la boucle d'édition : {avg_lag:.0f}ms en moyenne, "
+            f"{self.max_edit_lag * 1000:.0f}ms max\n"
+            f"- Débit : **{self.throughput:.2f}** éléments par seconde\n"
+        )
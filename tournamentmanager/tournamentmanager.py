@@ -1,23 +1,42 @@
 import discord
 import asyncio
-import re
 import json
+import math
+import time
+import itertools
 import logging
 
 from typing import Optional
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 from redbot.core import commands
 from redbot.core import Config
 from redbot.core import checks
 from redbot.core.bot import Red
+from redbot.core.data_manager import cog_data_path
 from redbot.core.utils.menus import start_adding_reactions
 from redbot.core.utils.predicates import ReactionPredicate
-from redbot.core.utils.chat_formatting import text_to_file, pagify
+from redbot.core.utils.chat_formatting import pagify
 
-from .progress_menu import UpdateRoles, Inscription, CheckIn
+from .progress_menu import (
+    UpdateRoles,
+    Inscription,
+    Lottery,
+    CheckIn,
+    ReactionCheckIn,
+    HistoryScan,
+)
+from .router import PhaseRouter
+from .roster import RosterStore, GuildRosters, BanRoster
+from .archive import TournamentArchive, STATUS_NAMES, CHECKED, NO_SHOW, REGISTERED
+from .settings import SettingsStore
+from .export import RosterExport, FORMATS
+from .ack import ACK_MODES
 
-MESSAGE_CHECK = re.compile(r"^je participe\.?$", flags=re.I)
+CHECKIN_MODES = {"message": "CheckIn", "reaction": "ReactionCheckIn"}
+BANS_PER_PAGE = 20
+# longer bans are given with a date, a bigger number is most likely a member ID
+MAX_BAN_TOURNAMENTS = 100
 log = logging.getLogger("red.laggron.tournamentmanager")
 
 
@@ -25,6 +44,26 @@ class UserInputError(Exception):
     pass
 
 
+class BanDuration(commands.Converter):
+    """
+    Durée d'un ban : un nombre de tournois, une date de fin ou `définitif`.
+    """
+
+    async def convert(self, ctx: commands.Context, argument: str) -> tuple:
+        # number of tournaments and timestamp, 0 for none
+        if argument.isdigit() and 0 < int(argument) <= MAX_BAN_TOURNAMENTS:
+            return int(argument), 0
+        if argument.lower() == "définitif":
+            return 0, 0
+        try:
+            return 0, datetime.strptime(argument, "%d/%m/%Y").timestamp()
+        except ValueError:
+            raise commands.BadArgument(
+                f"Donnez un nombre de tournois (jusqu'à {MAX_BAN_TOURNAMENTS}), une date "
+                "(`jj/mm/aaaa`) ou `définitif`."
+            )
+
+
 class TournamentManager(commands.Cog):
     """
     Gère l'inscription aux tournois de Bronol.
@@ -33,9 +72,23 @@ class TournamentManager(commands.Cog):
     default_guild = {
         "roles": {"participant": None, "tournament": None, "check": None,},
         "channels": {"inscription": None, "check": None,},
+        "export": {"format": "csv", "compress": False},
+        "shards": {"inscription": []},  # more inscription channels, sharing one ledger
+        "phases": {
+            "ack": "reaction",
+            "checkin_duration": 1800,
+            "checkin_mode": "message",
+            "checkin_reminders": [],  # minutes before the end of the check-in
+            "lottery_window": 0,  # seconds, 0 for first come first served
+        },
+        # moved to the roster files, only kept for migration
         "next_to_blacklist": [],  # members who didn't check, will be blacklisted at the end
         "blacklisted": [],
         "current": [],
+        "tournament_count": 0,  # ended tournaments, for the expiry of bans
+        "role_jobs": {},  # interrupted UpdateRoles, resumed on load
+        "deadlines": {},  # scheduled openings and deadlines of running phases
+        "running": {},  # state of the running phases, resumed on load
     }
 
     def __init__(self, bot: Red):
@@ -44,10 +97,11 @@ class TournamentManager(commands.Cog):
         self.data = Config.get_conf(self, 260)
         self.data.register_guild(**self.default_guild)
 
-        # cache
-        self.participant_roles = {}
-        self.checkin_roles = {}
-        self.inscription_channels = {}
+        self.router = PhaseRouter(self.data)
+        self.rosters = RosterStore(cog_data_path(self) / "rosters")
+        self.archive = TournamentArchive(cog_data_path(self) / "archive.db")
+        self.settings = SettingsStore(self.data, self.default_guild)
+        self.resume_task = self.bot.loop.create_task(self.resume())
 
     async def _ask_for(
         self,
@@ -64,61 +118,364 @@ class TournamentManager(commands.Cog):
             return False
         return pred.result
 
-    async def get_participant_role(self, guild: discord.Guild) -> discord.Role:
-        role_id = self.participant_roles.get(guild.id)
+    async def _get_role(self, guild: discord.Guild, key: str, name: str) -> discord.Role:
+        settings = await self.settings.get(guild)
+        role_id = settings.roles[key]
         if not role_id:
-            role_id = await self.data.guild(guild).roles.participant()
-            if not role_id:
-                raise UserInputError("Le rôle de participant n'est pas réglé.")
-            self.participant_roles[guild.id] = role_id
+            raise UserInputError(f"Le rôle {name} n'est pas réglé.")
         role = guild.get_role(role_id)
         if not role:
-            raise UserInputError("Le rôle de participant a été perdu.")
+            raise UserInputError(f"Le rôle {name} a été perdu.")
         return role
 
+    async def _get_channel(
+        self, guild: discord.Guild, key: str, name: str
+    ) -> discord.TextChannel:
+        settings = await self.settings.get(guild)
+        channel_id = settings.channels[key]
+        if not channel_id:
+            raise UserInputError(f"Le channel {name} n'est pas réglé.")
+        channel = guild.get_channel(channel_id)
+        if not channel:
+            raise UserInputError(f"Le channel {name} a été perdu.")
+        return channel
+
+    async def get_export(self, guild: discord.Guild) -> RosterExport:
+        settings = await self.settings.get(guild)
+        return RosterExport("participants", **settings.export)
+
+    async def get_participant_role(self, guild: discord.Guild) -> discord.Role:
+        return await self._get_role(guild, "participant", "de participant")
+
     async def get_checkin_role(self, guild: discord.Guild) -> discord.Role:
-        role_id = self.checkin_roles.get(guild.id)
-        if not role_id:
-            role_id = await self.data.guild(guild).roles.check()
-            if not role_id:
-                raise UserInputError("Le rôle de check-in n'est pas réglé.")
-            self.checkin_roles[guild.id] = role_id
-        role = guild.get_role(role_id)
-        if not role:
-            raise UserInputError("Le rôle de check-in a été perdu.")
-        return role
+        return await self._get_role(guild, "check", "de check-in")
 
     async def get_tournament_role(self, guild: discord.Guild) -> discord.Role:
-        # no cache for this one
-        role_id = await self.data.guild(guild).roles.tournament()
-        if not role_id:
-            raise UserInputError("Le rôle de tournois n'est pas réglé.")
-        role = guild.get_role(role_id)
-        if not role:
-            raise UserInputError("Le rôle de tournois a été perdu.")
-        return role
+        return await self._get_role(guild, "tournament", "de tournois")
 
     async def get_channel(self, guild: discord.Guild) -> discord.TextChannel:
-        channel_id = self.inscription_channels.get(guild.id)
-        if not channel_id:
-            channel_id = await self.data.guild(guild).channels.inscription()
-            if not channel_id:
-                raise UserInputError("Le channel d'inscriptions n'est pas réglé.")
-            self.inscription_channels[guild.id] = channel_id
-        channel = guild.get_channel(channel_id)
-        if not channel:
-            raise UserInputError("Le channel d'inscriptions a été perdu.")
-        return channel
+        return await self._get_channel(guild, "inscription", "d'inscriptions")
 
     async def get_checkin_channel(self, guild: discord.Guild) -> discord.TextChannel:
-        # no cache here too
-        channel_id = await self.data.guild(guild).channels.check()
-        if not channel_id:
-            raise UserInputError("Le channel de check-in n'est pas réglé.")
-        channel = guild.get_channel(channel_id)
+        return await self._get_channel(guild, "check", "de check-in")
+
+    def cog_unload(self):
+        self.resume_task.cancel()
+        for phase in self.router.active():
+            phase.stop()
+        # saved deadlines are armed again on load
+        self.router.deadlines.cancel_all()
+        self.bot.loop.create_task(self.rosters.flush())
+        self.archive.close()
+
+    async def get_rosters(self, guild: discord.Guild) -> GuildRosters:
+        rosters = await self.rosters.get(guild.id)
+        for name in GuildRosters.NAMES:
+            roster = getattr(rosters, name)
+            if not roster.new:
+                continue
+            # first load, import the list that was stored in Config
+            value = self.data.guild(guild).get_attr(name)
+            ids = await value()
+            if name == "blacklisted":
+                # bans used to last until the end of the next tournament
+                ids = [*rosters.legacy_blacklisted, *ids]
+                count = await self.data.guild(guild).tournament_count()
+                for member_id in ids:
+                    roster.add(member_id, until_tournament=count + 1)
+            else:
+                roster.extend(ids)
+            await roster.flush()
+            await value.set([])
+            # an empty roster writes no file, it would be imported again at each call
+            roster.new = False
+        return rosters
+
+    async def get_bans(self, guild: discord.Guild) -> BanRoster:
+        # ended bans are only removed when they are read
+        bans = (await self.get_rosters(guild)).blacklisted
+        count = await self.data.guild(guild).tournament_count()
+        if bans.expire(count, time.time()):
+            await bans.flush()
+        return bans
+
+    async def resume(self):
+        await self.bot.wait_until_ready()
+        all_guilds = await self.data.all_guilds()
+        self.settings.load_all(all_guilds)
+        for guild_id, data in all_guilds.items():
+            guild = self.bot.get_guild(guild_id)
+            if not guild:
+                continue
+            for job_id, job in data["role_jobs"].items():
+                try:
+                    await self._resume_role_job(guild, job_id, job)
+                except Exception as e:
+                    log.error(f"Impossible de reprendre la tâche de rôles {job_id}", exc_info=e)
+                    await self.data.guild(guild).role_jobs.clear_raw(job_id)
+            for key, state in data["running"].items():
+                try:
+                    await self._resume_phase(guild, state)
+                except Exception as e:
+                    log.error(f"Impossible de reprendre la phase {key}", exc_info=e)
+                    await self.data.guild(guild).running.clear_raw(key)
+                    self.bot.loop.create_task(self._close_orphan_phase(guild, key, state))
+            for key, info in data["deadlines"].items():
+                if key in data["running"]:
+                    # armed again by the resumed phase
+                    continue
+                self._resume_deadline(guild, key, info)
+
+    async def _get_context(self, guild: discord.Guild, info: dict) -> commands.Context:
+        # the context of the original command, for the progress messages and cancellation
+        channel = guild.get_channel(info["channel"])
         if not channel:
-            raise UserInputError("Le channel de check-in a été perdu.")
-        return channel
+            raise UserInputError("Le channel de la commande a été perdu.")
+        return await self.bot.get_context(await channel.fetch_message(info["message"]))
+
+    async def _resume_role_job(self, guild: discord.Guild, job_id: str, job: dict):
+        ctx = await self._get_context(guild, job)
+        roles = list(filter(None, [guild.get_role(x) for x in job["roles"]]))
+        if not roles:
+            raise UserInputError("Les rôles ont été perdus.")
+        members = list(filter(None, [guild.get_member(x) for x in job["pending"]]))
+        if not members:
+            await self.data.guild(guild).role_jobs.clear_raw(job_id)
+            return
+        await ctx.send(
+            f"Reprise d'une tâche de rôles interrompue ({len(members)} membres restants)."
+        )
+        n = UpdateRoles(
+            self.bot,
+            self.router,
+            self.data,
+            ctx,
+            members,
+            roles,
+            job["reason"],
+            add_roles=job["add"],
+            job_id=job_id,
+        )
+        self.bot.loop.create_task(n.run())
+
+    async def _resume_phase(self, guild: discord.Guild, state: dict):
+        ctx = await self._get_context(guild, state)
+        channel = guild.get_channel(state["phase_channel"])
+        role = guild.get_role(state["role"])
+        if not channel or not role:
+            raise UserInputError("Le channel ou le rôle de la phase a été perdu.")
+        rosters = await self.get_rosters(guild)
+        settings = await self.settings.get(guild)
+        if state["kind"] in ("Inscription", "Lottery"):
+            participant_role = guild.get_role(state["participant_role"])
+            kwargs = {}
+            if state["kind"] == "Lottery":
+                kwargs["time"] = settings.phases["lottery_window"] or 600
+            cls = Lottery if state["kind"] == "Lottery" else Inscription
+            n = cls(
+                self.bot,
+                self.router,
+                rosters,
+                ctx,
+                state["limit"],
+                channel,
+                role,
+                participant_role,
+                rosters.blacklisted,
+                export=await self.get_export(guild),
+                ack=settings.phases["ack"],
+                state=state,
+                shards=list(filter(None, map(guild.get_channel, state.get("shards", [])))),
+                **kwargs,
+            )
+            coro = n.run()
+        elif state["kind"] in CHECKIN_MODES.values():
+            check_role = guild.get_role(state["checkin_role"])
+            if not check_role:
+                raise UserInputError("Le rôle de check-in a été perdu.")
+            cls = ReactionCheckIn if state["kind"] == "ReactionCheckIn" else CheckIn
+            n = cls(
+                self.bot,
+                self.router,
+                rosters,
+                ctx,
+                channel,
+                check_role,
+                role,
+                export=await self.get_export(guild),
+                ack=settings.phases["ack"],
+                time=settings.phases["checkin_duration"],
+                state=state,
+                reminders=[x * 60 for x in settings.phases["checkin_reminders"]],
+            )
+            coro = self._run_checkin(ctx, n)
+        else:
+            raise UserInputError(f"Type de phase inconnu : {state['kind']}")
+        await ctx.send(
+            "Reprise de la phase interrompue, lecture des messages envoyés entre temps..."
+        )
+        self.bot.loop.create_task(coro)
+
+    def _resume_deadline(self, guild: discord.Guild, key: str, info: dict):
+        if info["kind"] == "inscription":
+            callback = self._open_scheduled_inscription
+        else:
+            # the phase itself is lost, only close its channel
+            callback = self._close_orphan_phase
+        self.router.deadlines.schedule(key, info["at"], callback, guild, key, info)
+
+    async def _open_scheduled_inscription(self, guild: discord.Guild, key: str, info: dict):
+        await self.router.deadlines.forget(guild, key)
+        try:
+            ctx = await self._get_context(guild, info)
+        except Exception as e:
+            log.error(f"Impossible d'ouvrir l'inscription programmée {key}", exc_info=e)
+            return
+        await self._start_inscription(ctx, info["limit"])
+
+    async def _close_orphan_phase(self, guild: discord.Guild, key: str, info: dict):
+        await self.router.deadlines.forget(guild, key)
+        channel = guild.get_channel(info.get("phase_channel"))
+        role = guild.get_role(info.get("role"))
+        if not channel or not role:
+            return
+        channels = [channel, *filter(None, map(guild.get_channel, info.get("shards", [])))]
+        overwrite = {"read_messages": True, "send_messages": False}
+        if info["kind"] == "ReactionCheckIn":
+            # the check-in is done by reacting, not by writing
+            overwrite["add_reactions"] = False
+        try:
+            for channel in channels:
+                await channel.set_permissions(role, **overwrite, reason="Fin de la phase")
+            ctx = await self._get_context(guild, info)
+            if info["kind"] == "Inscription":
+                for channel in channels:
+                    await channel.send("Fin des inscriptions.")
+                await ctx.send(
+                    "L'inscription a été interrompue par un redémarrage et n'a pas pu être "
+                    f"reprise, utilisez `{ctx.clean_prefix}manualregister`."
+                )
+            elif info["kind"] == "Lottery":
+                for channel in channels:
+                    await channel.send("Fin des inscriptions.")
+                await ctx.send(
+                    "Le tirage au sort a été interrompu par un redémarrage et n'a pas pu être "
+                    "repris, aucune place n'a été attribuée."
+                )
+            else:
+                await channel.send("Fin du check-in.")
+                await ctx.send(
+                    "Le check-in a été interrompu par un redémarrage et n'a pas pu être "
+                    "repris : les membres non checks n'ont pas été traités."
+                )
+        except Exception as e:
+            log.error(f"Erreur lors de la fermeture de la phase {key}", exc_info=e)
+
+    async def _plan_role_reset(self, guild: discord.Guild, role: discord.Role) -> tuple:
+        """
+        Lists what points to the role: channel overwrites and settings.
+        """
+        overwrites = [
+            (channel, channel.overwrites[role])
+            for channel in guild.channels
+            if role in channel.overwrites
+        ]
+        settings = await self.settings.get(guild)
+        keys = [key for group, key in settings.find(role.id) if group == "roles"]
+        return role, overwrites, keys
+
+    def _format_role_reset(self, role: discord.Role, overwrites: list, keys: list) -> str:
+        text = (
+            f"__Recréation du rôle {role.name}__ ({self.router.roles.count(role)} membres, "
+            f"position {role.position})\n"
+        )
+        for channel, overwrite in overwrites:
+            text += f"- Permissions du channel {channel.mention}\n"
+        for key in keys:
+            text += f"- Réglage `{key}`\n"
+        return text
+
+    async def _reset_role(
+        self, guild: discord.Guild, role: discord.Role, overwrites: list, keys: list
+    ) -> discord.Role:
+        """
+        Replaces the role with a copy without members, a constant number of calls.
+        """
+        reason = "Fin du tournoi, réinitialisation du rôle"
+        new_role = await guild.create_role(
+            name=role.name,
+            permissions=role.permissions,
+            colour=role.colour,
+            hoist=role.hoist,
+            mentionable=role.mentionable,
+            reason=reason,
+        )
+        await new_role.edit(position=role.position, reason=reason)
+        for channel, overwrite in overwrites:
+            await channel.set_permissions(new_role, overwrite=overwrite, reason=reason)
+        for key in keys:
+            await self.settings.set(guild, "roles", key, new_role.id)
+        await role.delete(reason=reason)
+        return new_role
+
+    async def _archive_tournament(
+        self, guild: discord.Guild, message: discord.Message, **members: list
+    ):
+        try:
+            await self.archive.record(
+                guild.id,
+                message.id,
+                # naive UTC in discord.py, timestamp() would read it as local time
+                message.created_at.replace(tzinfo=timezone.utc).timestamp(),
+                **members,
+            )
+        except Exception as e:
+            log.error("Erreur lors de l'archivage du tournoi", exc_info=e)
+
+    def _format_ban(self, expiry: tuple, count: int) -> str:
+        until_tournament, until = expiry
+        if until_tournament:
+            left = until_tournament - count
+            return "prochain tournoi" if left == 1 else f"{left} prochains tournois"
+        if until:
+            return "jusqu'au " + datetime.fromtimestamp(until).strftime("%d/%m/%Y")
+        return "définitif"
+
+    @commands.Cog.listener()
+    async def on_message(self, message: discord.Message):
+        await self.router.on_message(message)
+
+    @commands.Cog.listener()
+    async def on_reaction_add(self, reaction: discord.Reaction, user: discord.User):
+        await self.router.on_reaction_add(reaction, user)
+
+    @commands.Cog.listener()
+    async def on_member_update(self, before: discord.Member, after: discord.Member):
+        await self.router.on_member_update(before, after)
+
+    @commands.Cog.listener()
+    async def on_member_join(self, member: discord.Member):
+        await self.router.on_member_join(member)
+
+    @commands.Cog.listener()
+    async def on_member_remove(self, member: discord.Member):
+        await self.router.on_member_remove(member)
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        # after a new session, member updates may have been missed
+        self.router.roles.clear()
+
+    @commands.Cog.listener()
+    async def on_guild_role_delete(self, role: discord.Role):
+        self.router.roles.forget_role(role)
+        for group, key in await self.settings.forget(role.guild, role.id):
+            log.warning(f"Le rôle {key} du serveur {role.guild.id} a été supprimé.")
+
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        for group, key in await self.settings.forget(channel.guild, channel.id):
+            log.warning(f"Le channel {key} du serveur {channel.guild.id} a été supprimé.")
 
     @commands.group()
     @checks.admin_or_permissions(administrator=True)
@@ -137,7 +494,7 @@ class TournamentManager(commands.Cog):
         if role.position >= ctx.guild.me.top_role.position:
             await ctx.send("Ce rôle est au dessus de mon rôle, je ne peux donc pas l'assigner.")
             return
-        await self.data.guild(ctx.guild).roles.participant.set(role.id)
+        await self.settings.set(ctx.guild, "roles", "participant", role.id)
         await ctx.send("Rôle configuré!")
 
     @tournamentset.command(name="tournoi")
@@ -148,7 +505,7 @@ class TournamentManager(commands.Cog):
         if role.position >= ctx.guild.me.top_role.position:
             await ctx.send("Ce rôle est au dessus de mon rôle, je ne peux donc pas l'assigner.")
             return
-        await self.data.guild(ctx.guild).roles.tournament.set(role.id)
+        await self.settings.set(ctx.guild, "roles", "tournament", role.id)
         await ctx.send("Rôle configuré!")
 
     @tournamentset.command(name="inscription")
@@ -164,9 +521,33 @@ class TournamentManager(commands.Cog):
                 "J'ai besoin de la permission de lire les messages et d'éditer ce channel."
             )
             return
-        await self.data.guild(ctx.guild).channels.inscription.set(channel.id)
+        await self.settings.set(ctx.guild, "channels", "inscription", channel.id)
         await ctx.send("Channel configuré!")
 
+    @tournamentset.command(name="inscriptionshards")
+    async def tournamentset_inscriptionshards(
+        self, ctx: commands.Context, *channels: discord.TextChannel
+    ):
+        """
+        Définis des channels d'inscription supplémentaires.
+
+        Les inscriptions sont ouvertes dans tous ces channels en plus du channel d'inscription,
+        et classées dans l'ordre des messages. Ne donnez aucun channel pour n'en utiliser qu'un.
+        """
+        for channel in channels:
+            overwrite = channel.permissions_for(ctx.guild.me)
+            if overwrite.read_messages is False or overwrite.manage_channels is False:
+                await ctx.send(
+                    f"J'ai besoin de la permission de lire les messages et d'éditer "
+                    f"{channel.mention}."
+                )
+                return
+        await self.settings.set(ctx.guild, "shards", "inscription", [x.id for x in channels])
+        if channels:
+            await ctx.send(f"{len(channels)} channels supplémentaires configurés!")
+        else:
+            await ctx.send("Les inscriptions n'utiliseront que le channel d'inscription.")
+
     @tournamentset.command(name="checkin")
     async def tournamentset_checkin(self, ctx: commands.Context, *, channel: discord.TextChannel):
         """
@@ -178,7 +559,7 @@ class TournamentManager(commands.Cog):
                 "J'ai besoin de la permission de lire les messages et d'éditer ce channel."
             )
             return
-        await self.data.guild(ctx.guild).channels.check.set(channel.id)
+        await self.settings.set(ctx.guild, "channels", "check", channel.id)
         await ctx.send("Channel configuré!")
 
     @tournamentset.command(name="checkinrole")
@@ -189,28 +570,124 @@ class TournamentManager(commands.Cog):
         if role.position >= ctx.guild.me.top_role.position:
             await ctx.send("Ce rôle est au dessus de mon rôle, je ne peux donc pas l'assigner.")
             return
-        await self.data.guild(ctx.guild).roles.check.set(role.id)
+        await self.settings.set(ctx.guild, "roles", "check", role.id)
         await ctx.send("Rôle configuré!")
 
+    @tournamentset.command(name="export")
+    async def tournamentset_export(
+        self, ctx: commands.Context, format: str, compress: bool = False
+    ):
+        """
+        Définis le format des listes de participants envoyées.
+
+        - `format` Le format des fichiers, `csv` ou `json`
+        - `compress` (Optionel) Compresser les fichiers avec gzip
+        """
+        format = format.lower()
+        if format not in FORMATS:
+            await ctx.send(f"Format inconnu, choisissez parmi {', '.join(FORMATS)}.")
+            return
+        await self.settings.set(ctx.guild, "export", "format", format)
+        await self.settings.set(ctx.guild, "export", "compress", compress)
+        await ctx.send("Format configuré!")
+
+    @tournamentset.command(name="ack")
+    async def tournamentset_ack(self, ctx: commands.Context, mode: str):
+        """
+        Définis comment les messages acceptés sont confirmés.
+
+        - `reaction` Une réaction ✅ sur chaque message, abandonnée en cas de surcharge
+        - `summary` Un message régulier listant les membres acceptés
+        """
+        mode = mode.lower()
+        if mode not in ACK_MODES:
+            await ctx.send(f"Mode inconnu, choisissez parmi {', '.join(ACK_MODES)}.")
+            return
+        await self.settings.set(ctx.guild, "phases", "ack", mode)
+        await ctx.send("Mode de confirmation configuré!")
+
+    @tournamentset.command(name="checkduration")
+    async def tournamentset_checkduration(self, ctx: commands.Context, minutes: int):
+        """
+        Définis la durée du check-in, en minutes.
+        """
+        if minutes < 1:
+            await ctx.send("La durée doit être d'au moins une minute.")
+            return
+        await self.settings.set(ctx.guild, "phases", "checkin_duration", minutes * 60)
+        await ctx.send("Durée configurée!")
+
+    @tournamentset.command(name="checkmode")
+    async def tournamentset_checkmode(self, ctx: commands.Context, mode: str):
+        """
+        Définis comment les participants se checkent.
+
+        - `message` En envoyant `check` dans le channel
+        - `reaction` En réagissant à un message épinglé, les rôles sont donnés à la fin
+        """
+        mode = mode.lower()
+        if mode not in CHECKIN_MODES:
+            await ctx.send(f"Mode inconnu, choisissez parmi {', '.join(CHECKIN_MODES)}.")
+            return
+        await self.settings.set(ctx.guild, "phases", "checkin_mode", mode)
+        await ctx.send("Mode de check-in configuré!")
+
+    @tournamentset.command(name="checkrappels")
+    async def tournamentset_checkrappels(self, ctx: commands.Context, *minutes: int):
+        """
+        Définis quand rappeler le check-in en message privé aux participants non checks.
+
+        Donnez les minutes avant la fin du check-in, par exemple `10 2`. Sans argument, les
+        rappels sont désactivés.
+        """
+        settings = await self.settings.get(ctx.guild)
+        if any(x < 1 or x * 60 >= settings.phases["checkin_duration"] for x in minutes):
+            await ctx.send("Les rappels doivent être compris dans la durée du check-in.")
+            return
+        await self.settings.set(
+            ctx.guild, "phases", "checkin_reminders", sorted(set(minutes), reverse=True)
+        )
+        if minutes:
+            await ctx.send("Rappels configurés!")
+        else:
+            await ctx.send("Rappels désactivés.")
+
+    @tournamentset.command(name="tirage")
+    async def tournamentset_tirage(self, ctx: commands.Context, minutes: int):
+        """
+        Attribue les places par tirage au sort après une période d'inscription, en minutes.
+
+        Tous les membres inscrits pendant la période participent au tirage, les autres forment
+        une liste d'attente. Mettez 0 pour revenir aux premiers arrivés.
+        """
+        if minutes < 0:
+            await ctx.send("La durée ne peut pas être négative.")
+            return
+        await self.settings.set(ctx.guild, "phases", "lottery_window", minutes * 60)
+        if minutes:
+            await ctx.send(f"Les places seront tirées au sort après {minutes} minutes.")
+        else:
+            await ctx.send("Les places iront aux premiers inscrits.")
+
     @tournamentset.command(name="settings")
     async def tournamentset_settings(self, ctx: commands.Context):
         """
         Affiche les réglages enregistrés du module.
         """
         guild = ctx.guild
-        roles = await self.data.guild(guild).roles.all()
-        channels = await self.data.guild(guild).channels.all()
-        participants = len(await self.data.guild(guild).current())
-        blacklisted = len(await self.data.guild(guild).blacklisted())
+        settings = await self.settings.get(guild)
+        rosters = await self.get_rosters(guild)
+        participants = len(rosters.current)
+        blacklisted = len(rosters.blacklisted)
         roles_description = ""
         channels_description = ""
-        for key, role_id in roles.items():
+        for key, role_id in settings.roles.items():
             role = guild.get_role(role_id)
             if role:
                 roles_description += f"{key}: {role.name} ({role.id})\n"
             else:
                 roles_description += f"{key}: Non défini\n"
-        for key, channel_id in channels.items():
+        for key, channel_id in settings.channels.items():
             channel = guild.get_channel(channel_id)
             if channel:
                 channels_description += f"{key}: {channel.mention} ({channel.id})\n"
@@ -221,6 +698,38 @@ class TournamentManager(commands.Cog):
         embed.description = "Réglages du module de gestion de tournois."
         embed.add_field(name="Rôles", value=roles_description, inline=False)
         embed.add_field(name="Channels", value=channels_description, inline=False)
+        embed.add_field(
+            name="Export",
+            value=settings.export["format"] + (" (gzip)" if settings.export["compress"] else ""),
+            inline=False,
+        )
+        shards = [guild.get_channel(x) for x in settings.shards["inscription"]]
+        if shards:
+            embed.add_field(
+                name="Channels d'inscription supplémentaires",
+                value=", ".join(x.mention for x in shards if x) or "Perdus",
+                inline=False,
+            )
+        embed.add_field(name="Confirmations", value=settings.phases["ack"], inline=False)
+        window = settings.phases["lottery_window"]
+        if window:
+            mode = f"Tirage au sort après {window // 60} minutes"
+        else:
+            mode = "Premiers arrivés"
+        embed.add_field(name="Inscription", value=mode, inline=False)
+        if settings.phases["checkin_reminders"]:
+            minutes = ", ".join(str(x) for x in settings.phases["checkin_reminders"])
+            reminders = f"rappels {minutes} minutes avant la fin"
+        else:
+            reminders = "sans rappel"
+        embed.add_field(
+            name="Check-in",
+            value=(
+                f"{settings.phases['checkin_duration'] // 60} minutes, "
+                f"mode {settings.phases['checkin_mode']}, {reminders}"
+            ),
+            inline=False,
+        )
         embed.add_field(
             name="Participants", value=f"{participants} membres enregistrés", inline=True
         )
@@ -242,14 +751,31 @@ class TournamentManager(commands.Cog):
         pass
 
     @tournamentban.command(name="add")
-    async def tournamentban_add(self, ctx: commands.Context, *, member: discord.Member):
+    async def tournamentban_add(
+        self,
+        ctx: commands.Context,
+        duration: Optional[BanDuration] = None,
+        *,
+        member: discord.Member,
+    ):
         """
-        Empêche un membre de participer au prochain tournoi.
+        Empêche un membre de participer aux prochains tournois.
+
+        La durée, donnée avant le membre, est un nombre de tournois (1 par défaut, 100 au
+        plus), une date de fin au format `jj/mm/aaaa` ou `définitif`.
         """
         guild = ctx.guild
-        async with self.data.guild(guild).blacklisted() as blacklist:
-            blacklist.append(member.id)
-        text = "Membre blacklisté pour le prochain tournoi."
+        tournaments, until = duration or (1, 0)
+        if until and until <= time.time():
+            await ctx.send("La date de fin du ban est déjà passée.")
+            return
+        count = await self.data.guild(guild).tournament_count()
+        # tournament count and timestamp at which the ban ends
+        expiry = (count + tournaments if tournaments else 0, until)
+        bans = await self.get_bans(guild)
+        bans.add(member.id, *expiry)
+        await bans.flush()
+        text = f"Membre blacklisté ({self._format_ban(expiry, count)})."
         try:
             role = await self.get_participant_role(guild)
         except UserInputError:
@@ -266,30 +792,36 @@ class TournamentManager(commands.Cog):
         Retire le ban d'un membre.
         """
         guild = ctx.guild
-        async with self.data.guild(guild).blacklisted() as blacklist:
-            try:
-                blacklist.remove(member.id)
-            except KeyError:
-                await ctx.send("Le membre n'est pas dans la blacklist.")
-            else:
-                await ctx.send("Le membre n'est plus banni.")
+        rosters = await self.get_rosters(guild)
+        if not rosters.blacklisted.discard(member.id):
+            await ctx.send("Le membre n'est pas dans la blacklist.")
+            return
+        await rosters.blacklisted.flush()
+        await ctx.send("Le membre n'est plus banni.")
 
     @tournamentban.command(name="list")
-    async def tournamentban_list(self, ctx: commands.Context):
+    async def tournamentban_list(self, ctx: commands.Context, page: int = 1):
         """
-        Liste tous les membres bannis du prochain tournoi.
+        Liste les membres bannis des prochains tournois, par pages.
         """
         guild = ctx.guild
-        text = "Liste des membres bannis:\n\n"
-        async with self.data.guild(guild).blacklisted() as blacklist:
-            for member_id in blacklist:
-                member = guild.get_member(member_id)
-                if member:
-                    text += f"- {str(member)} ({member.id})\n"
-                else:
-                    text += f"- {member_id} (le membre n'est plus sur le serveur)\n"
-        for page in pagify(text):
-            await ctx.send(page)
+        bans = await self.get_bans(guild)
+        count = await self.data.guild(guild).tournament_count()
+        pages = max(math.ceil(len(bans) / BANS_PER_PAGE), 1)
+        if not 1 <= page <= pages:
+            await ctx.send(f"Il y a {pages} pages.")
+            return
+        start = (page - 1) * BANS_PER_PAGE
+        text = f"Liste des membres bannis ({len(bans)}, page {page}/{pages}) :\n\n"
+        # only the members of this page are resolved
+        for member_id, expiry in itertools.islice(bans.ids.items(), start, start + BANS_PER_PAGE):
+            member = guild.get_member(member_id)
+            if member:
+                text += f"- {str(member)} ({member.id})"
+            else:
+                text += f"- {member_id} (le membre n'est plus sur le serveur)"
+            text += f" : {self._format_ban(expiry, count)}\n"
+        await ctx.send(text)
 
     @tournamentban.command(name="clear")
     async def tournamentban_clear(self, ctx: commands.Context):
@@ -297,29 +829,41 @@ class TournamentManager(commands.Cog):
         Nettoie la liste des membres bannis.
         """
         guild = ctx.guild
-        await self.data.guild(guild).blacklisted.set([])
+        rosters = await self.get_rosters(guild)
+        rosters.blacklisted.clear()
+        await rosters.blacklisted.flush()
         await ctx.send("La blacklist a été réinitialisée.")
 
     @commands.command()
     @checks.mod()
     @commands.guild_only()
-    async def inscription(self, ctx: commands.Context, limit: int):
+    async def inscription(
+        self,
+        ctx: commands.Context,
+        limit: int,
+        *,
+        delay: commands.TimedeltaConverter(default_unit="minutes") = None,
+    ):
         """
         Lance l'inscription pour le tournoi avec la limite de participants donnée.
+
+        Donnez un délai (par exemple `1h30m`) pour programmer l'ouverture.
         """
         guild = ctx.guild
         try:
             role = await self.get_tournament_role(guild)
-            participant_role = await self.get_participant_role(guild)
+            await self.get_participant_role(guild)
             channel = await self.get_channel(guild)
         except UserInputError as e:
             await ctx.send(e.args[0])
             return
         if not ctx.assume_yes:
+            opening = f"Ouverture dans {delay}\n\n" if delay else "\n"
             message = await ctx.send(
                 f"Channel d'inscription: {channel.mention}\n"
                 f"Role de tournois: {role.name}\n"
-                f"Limite de participants: {limit}\n\n"
+                f"Limite de participants: {limit}\n"
+                f"{opening}"
                 f"Lancer l'inscription ?"
             )
             result = await self._ask_for(ctx, message)
@@ -327,27 +871,83 @@ class TournamentManager(commands.Cog):
                 await ctx.send("Annulation.")
                 return
             await message.delete()
-        await self.data.guild(guild).current.set([])
-        blacklist = await self.data.guild(guild).blacklisted()
-        n = Inscription(
-            self.bot, self.data, ctx, limit, channel, role, participant_role, blacklist
+        if delay:
+            key = f"inscription-{ctx.message.id}"
+            info = {
+                "kind": "inscription",
+                "limit": limit,
+                "channel": ctx.channel.id,
+                "message": ctx.message.id,
+            }
+            at = time.time() + delay.total_seconds()
+            await self.router.deadlines.save(guild, key, at, **info)
+            self.router.deadlines.schedule(
+                key, at, self._open_scheduled_inscription, guild, key, info
+            )
+            await ctx.send(f"Ouverture des inscriptions programmée dans {delay}.")
+            return
+        await self._start_inscription(ctx, limit)
+
+    async def _start_inscription(self, ctx: commands.Context, limit: int):
+        guild = ctx.guild
+        try:
+            role = await self.get_tournament_role(guild)
+            participant_role = await self.get_participant_role(guild)
+            channel = await self.get_channel(guild)
+        except UserInputError as e:
+            await ctx.send(e.args[0])
+            return
+        settings = await self.settings.get(guild)
+        shards = [guild.get_channel(x) for x in settings.shards["inscription"]]
+        rosters = await self.get_rosters(guild)
+        for roster in (rosters.current, rosters.waitlist):
+            roster.clear()
+            await roster.flush()
+        kwargs = {}
+        window = settings.phases["lottery_window"]
+        if window:
+            kwargs["time"] = window
+        cls = Lottery if window else Inscription
+        n = cls(
+            self.bot,
+            self.router,
+            rosters,
+            ctx,
+            limit,
+            channel,
+            role,
+            participant_role,
+            await self.get_bans(guild),
+            export=await self.get_export(guild),
+            ack=settings.phases["ack"],
+            shards=[x for x in shards if x and x != channel],
+            **kwargs,
         )
         await n.run()
 
     @commands.command()
     @checks.mod()
-    async def valid(self, ctx: commands.Context, number: int):
+    async def valid(self, ctx: commands.Context, number: int, source: str = None):
         """
         Valide un certain nombre de membres pour l'inscription.
+
+        Ajoutez `attente` pour valider les premiers membres de la liste d'attente du dernier
+        tirage, qui rejoignent alors les participants.
         """
         guild = ctx.guild
-        participants = await self.data.guild(guild).current()
-        participants = list(filter(None, [guild.get_member(x) for x in participants]))
+        if source is not None and source.lower() != "attente":
+            await ctx.send("Seule la liste `attente` peut être donnée.")
+            return
+        rosters = await self.get_rosters(guild)
+        roster = rosters.waitlist if source else rosters.current
+        participants = list(filter(None, [guild.get_member(x) for x in roster]))
         total = len(participants)
         if number > total:
-            await ctx.send(
-                f"La limite est plus élevée que le nombre de joueurs retenus ({total})."
-            )
+            if source:
+                text = f"La liste d'attente ne contient que {total} joueurs."
+            else:
+                text = f"La limite est plus élevée que le nombre de joueurs retenus ({total})."
+            await ctx.send(text)
             return
         try:
             role = await self.get_participant_role(guild)
@@ -361,7 +961,22 @@ class TournamentManager(commands.Cog):
         if result is False:
             await ctx.send("Annulation.")
             return
-        n = UpdateRoles(self.bot, ctx, participants[:number], [role], "Participation au tournoi.")
+        if source:
+            # promoted members leave the waitlist for good, even if the role job fails
+            for member in participants[:number]:
+                rosters.waitlist.discard(member.id)
+                rosters.current.add(member.id)
+            await rosters.waitlist.flush()
+            await rosters.current.flush()
+        n = UpdateRoles(
+            self.bot,
+            self.router,
+            self.data,
+            ctx,
+            participants[:number],
+            [role],
+            "Participation au tournoi.",
+        )
         await n.run()
 
     @commands.command()
@@ -385,32 +1000,36 @@ class TournamentManager(commands.Cog):
         if not channel.permissions_for(guild.me).read_message_history:
             await ctx.send("Je ne peux pas lire l'historique des messages dans ce channel.")
             return
-        participants = []
-        if after:
-            after = after.created_at
-        blacklist = await self.data.guild(guild).blacklisted()
-        await self.data.guild(guild).current.set([])
-        async with ctx.typing():
-            async for message in channel.history(oldest_first=True, after=after):
-                if not MESSAGE_CHECK.match(message.content):
-                    return
-                member = message.author
-                if member.id in blacklist:
-                    return
-                participants.append(member)
-                if len(participants) >= limit:
-                    break
+        try:
+            participant_role = await self.get_participant_role(guild)
+        except UserInputError:
+            participant_role = None
+        rosters = await self.get_rosters(guild)
+        n = HistoryScan(
+            self.bot,
+            self.router,
+            ctx,
+            limit,
+            channel,
+            participant_role,
+            await self.get_bans(guild),
+            after=after.id if after else 0,
+            export=await self.get_export(guild),
+        )
+        await n.run()
+        await n.wait()
+        if n.stopped:
+            return
+        participants = list(n.participants)
         if len(participants) < limit:
             await ctx.send(f"Pas assez de participants trouvés ({len(participants)}/{limit})")
             return
-        await self.data.guild(guild).current.set(participants)
-        await ctx.send(
-            f"Inscription terminée, {len(participants)} membres enregistrés. Envoi du fichier..."
-        )
+        rosters.current.replace(participants)
+        await rosters.current.flush()
         async with ctx.typing():
-            content = "\n".join((str(guild.get_member(x)) for x in participants))
-            file = text_to_file(content, "participants.txt")
-            await ctx.send(file=file)
+            await n.export.send(
+                ctx, f"Inscription terminée, {len(participants)} membres enregistrés."
+            )
 
     @commands.command()
     @checks.mod()
@@ -419,8 +1038,9 @@ class TournamentManager(commands.Cog):
         Affiche diverses informations liées au tournoi.
         """
         guild = ctx.guild
-        participants = await self.data.guild(guild).current()
-        blacklisted = await self.data.guild(guild).blacklisted()
+        rosters = await self.get_rosters(guild)
+        participants = rosters.current
+        blacklisted = rosters.blacklisted
         text = (
             "__Informations sur le tournoi__\n"
             f"- Nombre de participants enregistrés : **{len(participants)}**\n"
@@ -434,7 +1054,7 @@ class TournamentManager(commands.Cog):
         else:
             text += (
                 f"- Nombre de membres avec le rôle {tournament_role.name} "
-                f": **{len(tournament_role.members)}**\n"
+                f": **{self.router.roles.count(tournament_role)}**\n"
             )
         try:
             participant_role = await self.get_participant_role(guild)
@@ -443,7 +1063,7 @@ class TournamentManager(commands.Cog):
         else:
             text += (
                 f"- Nombre de membres avec le rôle {participant_role.name} "
-                f": **{len(participant_role.members)}**\n"
+                f": **{self.router.roles.count(participant_role)}**\n"
             )
         try:
             check_role = await self.get_checkin_role(guild)
@@ -452,10 +1072,61 @@ class TournamentManager(commands.Cog):
         else:
             text += (
                 f"- Nombre de membres avec le rôle {check_role.name} "
-                f": **{len(check_role.members)}**\n"
+                f": **{self.router.roles.count(check_role)}**\n"
             )
         await ctx.send(text)
 
+    @commands.command()
+    @checks.mod()
+    @commands.guild_only()
+    async def tstats(self, ctx: commands.Context):
+        """
+        Affiche les métriques de la phase en cours ou de la dernière phase.
+        """
+        phases = self.router.active(ctx.guild)
+        if phases:
+            stats = [x.stats for x in phases]
+        elif ctx.guild.id in self.router.last_stats:
+            stats = [self.router.last_stats[ctx.guild.id]]
+        else:
+            await ctx.send("Aucune phase n'a été lancée depuis le chargement du module.")
+            return
+        for page in pagify("\n".join(x.format() for x in stats)):
+            await ctx.send(page)
+
+    @commands.command()
+    @checks.mod()
+    @commands.guild_only()
+    async def thistory(self, ctx: commands.Context, *, member: discord.Member):
+        """
+        Affiche l'historique des tournois d'un membre.
+        """
+        guild = ctx.guild
+        summary = await self.archive.member_summary(guild.id, member.id)
+        history = await self.archive.member_history(guild.id, member.id)
+        counts = summary["counts"]
+        if not counts:
+            await ctx.send(
+                f"{member} n'apparaît dans aucun des {summary['total']} tournois archivés."
+            )
+            return
+        checked = counts.get(CHECKED, 0)
+        no_shows = counts.get(NO_SHOW, 0)
+        rate = round(no_shows / (checked + no_shows) * 100, 1) if checked + no_shows else 0
+        text = (
+            f"__Historique de {member}__\n"
+            f"- Tournois archivés : **{summary['total']}**\n"
+            f"- Inscriptions : **{sum(counts.values())}** "
+            f"(dont **{counts.get(REGISTERED, 0)}** sans rôle de participant)\n"
+            f"- Participations (check) : **{checked}**\n"
+            f"- Absences (pas de check) : **{no_shows}** ({rate}% d'absences)\n\n"
+            "__Derniers tournois__\n"
+        )
+        for tournament_id, ended_at, status in history:
+            date = datetime.utcfromtimestamp(ended_at).strftime("%d/%m/%Y")
+            text += f"- {date} : {STATUS_NAMES[status]}\n"
+        await ctx.send(text)
+
     @commands.command(name="list")
     @checks.mod()
     async def _list(self, ctx: commands.Context):
@@ -468,21 +1139,22 @@ class TournamentManager(commands.Cog):
         except UserInputError as e:
             await ctx.send(e.args[0])
             return
+        try:
+            checked = self.router.roles.members(await self.get_checkin_role(guild))
+        except UserInputError:
+            checked = None
         async with ctx.typing():
-            text = "Liste des membres avec le rôle participant:\n\n"
-            for member in role.members:
-                text += str(member) + "\n"
-            text += f"\nNombre de participants : {len(role.members)}"
-            file = text_to_file(text, filename="participants.txt")
-            await ctx.send(
-                f"Liste des {len(role.members)} membres participants.", file=file,
-            )
+            export = await self.get_export(guild)
+            for member in self.router.roles.resolve(guild, self.router.roles.members(role)):
+                status = None if checked is None else member.id in checked
+                export.add(member.id, str(member), checked=status)
+            await export.send(ctx, f"Liste des {len(export)} membres participants.")
 
     @commands.command()
     @checks.mod()
     async def startcheck(self, ctx: commands.Context):
         """
-        Démarre la phase de check pendant 30 minutes.
+        Démarre la phase de check pendant la durée réglée (30 minutes par défaut).
         """
         guild = ctx.guild
         try:
@@ -492,7 +1164,7 @@ class TournamentManager(commands.Cog):
         except UserInputError as e:
             await ctx.send(e.args[0])
             return
-        total = len(participant_role.members)
+        total = self.router.roles.count(participant_role)
         if total < 1:
             await ctx.send(f"Aucun membre n'a le rôle {participant_role.name} !")
             return
@@ -508,50 +1180,122 @@ class TournamentManager(commands.Cog):
                 await ctx.send("Annulation.")
                 return
             await message.delete()
-        n = CheckIn(self.bot, self.data, ctx, channel, check_role, participant_role)
+        rosters = await self.get_rosters(guild)
+        settings = await self.settings.get(guild)
+        cls = ReactionCheckIn if settings.phases["checkin_mode"] == "reaction" else CheckIn
+        n = cls(
+            self.bot,
+            self.router,
+            rosters,
+            ctx,
+            channel,
+            check_role,
+            participant_role,
+            export=await self.get_export(guild),
+            ack=settings.phases["ack"],
+            time=settings.phases["checkin_duration"],
+            reminders=[x * 60 for x in settings.phases["checkin_reminders"]],
+        )
+        await self._run_checkin(ctx, n)
+
+    async def _run_checkin(self, ctx: commands.Context, n: CheckIn):
+        participant_role = n.participant_role
         await n.run()
-        try:
-            await n.update_message_task
-        except asyncio.CancelledError:
-            pass
-        try:
-            await n.cancel_task
-        except asyncio.CancelledError:
-            pass
+        await n.wait()
+        if n.stopped:
+            return
+        if isinstance(n, ReactionCheckIn) and n.to_check:
+            await asyncio.sleep(1)
+            await ctx.send(f"Ajout du rôle {n.checkin_role.name} aux membres checks...")
+            job = UpdateRoles(
+                self.bot,
+                self.router,
+                self.data,
+                ctx,
+                n.to_check,
+                [n.checkin_role],
+                "Check-in tournoi",
+            )
+            await job.run()
+            await job.wait()
+            if job.stopped:
+                return
         await asyncio.sleep(1)
         await ctx.send(f"Retrait du rôle {participant_role.name} aux membres non checks...")
         n = UpdateRoles(
-            self.bot, ctx, n.to_blacklist, [participant_role], "Membre non check", add_roles=False
+            self.bot,
+            self.router,
+            self.data,
+            ctx,
+            n.to_blacklist,
+            [participant_role],
+            "Membre non check",
+            add_roles=False,
         )
         await n.run()
 
     @commands.command()
     @checks.mod()
-    async def endtournament(self, ctx: commands.Context):
+    async def endtournament(self, ctx: commands.Context, mode: str = None):
         """
         Met fin au tournoi actuel.
         
         Cette commande fait les actions suivantes :
         - Retrait des rôles de participants et de check à tous les membres
-        - Réinitialisation de la blacklist
-        - Ajout des membres non checks (qui ne se sont pas inscrits entre temps) à la blacklist
+        - Fin des bans expirés
+        - Ban des membres non checks (qui ne se sont pas inscrits entre temps) pour le prochain
+        tournoi
+
+        Modes optionnels :
+        - `fast` Recrée les rôles au lieu de les retirer un par un
+        - `dryrun` Affiche ce que `fast` modifierait, sans rien faire
         """
         guild = ctx.guild
+        if mode not in (None, "fast", "dryrun"):
+            await ctx.send("Mode inconnu, choisissez parmi `fast` et `dryrun`.")
+            return
         try:
             check_role = await self.get_checkin_role(guild)
             participant_role = await self.get_participant_role(guild)
         except UserInputError as e:
             await ctx.send(e.args[0])
             return
-        next_to_blacklist = await self.data.guild(guild).next_to_blacklist()
+        if mode is not None:
+            plans = [await self._plan_role_reset(guild, x) for x in (check_role, participant_role)]
+            if mode == "dryrun":
+                for page in pagify("\n".join(self._format_role_reset(*x) for x in plans)):
+                    await ctx.send(page)
+                return
+            if self.router.active(guild):
+                await ctx.send("Une phase est en cours, impossible de recréer les rôles.")
+                return
+            if not guild.me.guild_permissions.manage_roles or any(
+                x.position >= guild.me.top_role.position for x in (check_role, participant_role)
+            ):
+                await ctx.send("Je ne peux pas gérer ces rôles, utilisez le mode normal.")
+                return
+        rosters = await self.get_rosters(guild)
+        next_to_blacklist = list(rosters.next_to_blacklist)
+        participants = self.router.roles.members(participant_role)
+        checked = self.router.roles.members(check_role)
         if not ctx.assume_yes:
+            if mode == "fast":
+                action = (
+                    f'- Recréation des rôles "{participant_role.name}" et "{check_role.name}" '
+                    f"({len(participants)} membres, `{ctx.clean_prefix}endtournament dryrun` "
+                    "pour le détail)\n"
+                )
+            else:
+                action = (
+                    f'- Retrait des rôles "{participant_role.name}" et "{check_role.name}" '
+                    f"à tous les membres ({len(participants)} membres)\n"
+                )
             message = await ctx.send(
                 "Cette commande va exécuter les actions suivantes :\n"
-                f'- Retrait des rôles "{participant_role.name}" et "{check_role.name}" à tous '
-                f"les membres ({len(participant_role.members)} membres)\n"
-                "- Réinitialisation de la blacklist\n"
-                f"- Ajout des {len(next_to_blacklist)} membres n'ayant pas check et ne s'étant "
-                "pas inscrit entre temps à la blacklist\n\n"
+                f"{action}"
+                "- Fin des bans expirés\n"
+                f"- Ban des {len(next_to_blacklist)} membres n'ayant pas check et ne s'étant "
+                "pas inscrit entre temps pour le prochain tournoi\n\n"
                 "Continuer ?"
             )
             result = await self._ask_for(ctx, message)
@@ -559,28 +1303,50 @@ class TournamentManager(commands.Cog):
                 await ctx.send("Annulation...")
                 return
             await message.delete()
-        members = check_role.members.copy()
-        members.extend(x for x in participant_role.members if x not in check_role.members)
-        n = UpdateRoles(
-            self.bot,
-            ctx,
-            members,
-            [check_role, participant_role],
-            reason="Fin du tournoi",
-            add_roles=False,
+        # archived in the background, with the rosters and roles as they were
+        self.bot.loop.create_task(
+            self._archive_tournament(
+                guild,
+                ctx.message,
+                registered=list(rosters.current),
+                participants=list(participants),
+                checked=list(checked),
+                no_shows=next_to_blacklist,
+            )
         )
-        await n.run()
-        try:
-            await n.update_message_task
-        except asyncio.CancelledError:
-            pass
-        try:
-            await n.cancel_task
-        except asyncio.CancelledError:
-            pass
-        await self.data.guild(guild).blacklisted.set(next_to_blacklist)
-        await self.data.guild(guild).next_to_blacklist.set([])
-        text = "Blacklist réinitialisée.\n"
+        # done first, the role job can be resumed after a restart but not what follows it
+        count = await self.data.guild(guild).tournament_count() + 1
+        await self.data.guild(guild).tournament_count.set(count)
+        expired = rosters.blacklisted.expire(count, time.time())
+        for member_id in next_to_blacklist:
+            # a longer ban is kept, like the bans until a date or for good
+            until_tournament, until = rosters.blacklisted.ids.get(member_id, (count + 1, 0))
+            if until_tournament and not until:
+                rosters.blacklisted.add(member_id, max(until_tournament, count + 1))
+        rosters.next_to_blacklist.clear()
+        await rosters.flush()
+        if mode == "fast":
+            async with ctx.typing():
+                for plan in plans:
+                    await self._reset_role(guild, *plan)
+            text = "Rôles recréés.\n"
+        else:
+            members = self.router.roles.resolve(guild, checked | participants)
+            n = UpdateRoles(
+                self.bot,
+                self.router,
+                self.data,
+                ctx,
+                members,
+                [check_role, participant_role],
+                reason="Fin du tournoi",
+                add_roles=False,
+            )
+            await n.run()
+            await n.wait()
+            text = "Tournoi terminé.\n"
+        if expired:
+            text += f"{len(expired)} bans ont expiré.\n"
         if next_to_blacklist:
             if len(next_to_blacklist) == 1:
                 text += "Le membre n'ayant pas check a été ajouté à la blacklist.\n"